@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#
+# ACbatch.py - run the ACtree selector over a list of raw active
+#              collimator tree files in a local pool of processes,
+#              one serialized output file per run, and merge the
+#              fourier spectra of all of the runs at the end.
+#
+# author: richard.t.jones at uconn.edu
+# version: october 18, 2026
+#
+# usage:
+#          $ ACbatch.py [-j <nproc>] [-c <nchunks>] [-o <merged.root>]
+#                       [-O <options>] <ac_YYYYMMDD_hhmmss.root | glob> ...
+#
+# notes:
+# 1) Each run ac_YYYYMMDD_hhmmss.root is written to
+#    ac_YYYYMMDD_hhmmss_serial.root, just as ACtree.sh does, with
+#    the ACtree log in ac_YYYYMMDD_hhmmss_serial.log.
+# 2) The merged spectra are the averages of the per-run FThist
+#    spectra weighted by the FIhist sample counts.
+# 3) With --chunks n each run is also split into n entry ranges that
+#    are processed in parallel, ACtree rebuilding its baselines at
+#    the start of each range (see warmup_records in ACtree.C). The
+#    act trees of the chunks are concatenated in order and their
+#    spectra merged into the usual _serial.root output for the run.
+# 4) Before anything else the summary sidecar of each run is made or
+#    brought up to date by acsummary.py (see its log in
+#    ac_YYYYMMDD_hhmmss_summary.log), and runs for which that fails
+#    are not processed. ACtree reads the record timestamps and beam
+#    currents from it, never from the full raw records.
+# 5) The alignment table of each run is kept in
+#    ac_YYYYMMDD_hhmmss_align.root in the output directory. With
+#    --chunks n it is built once per run before the chunks start,
+#    and the chunks all read it instead of each scanning the run.
+
+import multiprocessing
+import subprocess
+import argparse
+import glob
+import sys
+import os
+
+spectra = ["ixp", "ixm", "iyp", "iym", "oxp", "oxm", "oyp", "oym"]
+
+def serial_name(rawfile, outdir="."):
+   base = os.path.basename(rawfile)
+   if base.endswith(".root"):
+      base = base[:-5]
+   return os.path.join(outdir, base + "_serial.root")
+
+def align_name(outfile):
+   return outfile[:-len("_serial.root")] + "_align.root"
+
+def root_session(script, logfile):
+   log = open(logfile, "w")
+   proc = subprocess.Popen(["root", "-l", "-b"], stdin=subprocess.PIPE,
+                           stdout=log, stderr=subprocess.STDOUT)
+   proc.communicate(script.encode())
+   log.close()
+   return proc.returncode
+
+def make_summary(rawfile, outdir="."):
+   """
+   Run acsummary.py on rawfile in a process of its own, and return
+   (rawfile, logfile, exit code).
+   """
+   summarizer = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "acsummary.py")
+   logfile = serial_name(rawfile, outdir)[:-len("_serial.root")] + \
+             "_summary.log"
+   log = open(logfile, "w")
+   res = subprocess.call([sys.executable, summarizer, rawfile],
+                         stdout=log, stderr=subprocess.STDOUT)
+   log.close()
+   return (rawfile, logfile, res)
+
+def summary_job(job):
+   return make_summary(*job)
+
+def compile_selector():
+   """
+   Build ACtree once up front, so the workers all load the same
+   library instead of racing each other through ACLiC.
+   """
+   script = ('gSystem->CompileMacro("ACtree.C", "kO");\n' +
+             '.q\n')
+   return root_session(script, "ACtree_build.log")
+
+def process_run(job):
+   rawfile, outfile, options, first, nentries = job
+   if nentries > 0:
+      entries = ', {0}, {1}'.format(nentries, first)
+   else:
+      entries = ''
+   script = ('TFile *f = TFile::Open("{0}");\n'.format(rawfile) +
+             'TTree *t = (TTree*)f->Get("N9:raw_XP");\n' +
+             't->Process("ACtree.C+O", "{0} out={1}"{2});\n'.format(options,
+                                                                  outfile,
+                                                                  entries) +
+             '.q\n')
+   res = root_session(script, outfile[:-5] + ".log")
+   return (rawfile, outfile, res)
+
+def build_alignment(job):
+   """
+   Have ACtree write the alignment table of one run to alignfile,
+   without processing any of its records.
+   """
+   rawfile, alignfile = job
+   script = ('.L ACtree.C+O\n' +
+             'TFile *f = TFile::Open("{0}");\n'.format(rawfile) +
+             'TTree *t = (TTree*)f->Get("N9:raw_XP");\n' +
+             'ACtree *sel = new ACtree();\n' +
+             'sel->SetOption("align={0}");\n'.format(alignfile) +
+             'sel->Init(t);\n' +
+             '.q\n')
+   res = root_session(script, alignfile[:-5] + ".log")
+   return (rawfile, alignfile, res)
+
+def count_entries(rawfile):
+   import ROOT
+   f = ROOT.TFile(rawfile)
+   tree = f.Get("N9:raw_XP")
+   entries = tree.GetEntries() if tree else 0
+   f.Close()
+   return entries
+
+def chunk_jobs(rawfile, outfile, options, nchunks):
+   """
+   Split one run into nchunks entry ranges, each with its own output
+   file <run>_serial_chunkNN.root.
+   """
+   entries = count_entries(rawfile)
+   nchunks = max(1, min(nchunks, entries))
+   jobs = []
+   for n in range(0, nchunks):
+      first = entries * n // nchunks
+      last = entries * (n + 1) // nchunks
+      chunkfile = outfile[:-5] + "_chunk{0:02d}.root".format(n)
+      jobs.append((rawfile, chunkfile, options, first, last - first))
+   return jobs
+
+def merge_chunks(chunkfiles, outfile):
+   """
+   Concatenate the act trees of the chunks of a run in entry order
+   and merge their spectra, writing the result to outfile.
+   """
+   import ROOT
+   chain = ROOT.TChain("act")
+   for chunkfile in chunkfiles:
+      chain.Add(chunkfile)
+   fout = ROOT.TFile(outfile, "recreate")
+   chain.Merge(fout, 0, "keep")
+   fout.Close()
+   merge_spectra(chunkfiles, outfile, "update")
+   for chunkfile in chunkfiles:
+      os.remove(chunkfile)
+
+def merge_spectra(outfiles, mergedfile, mode="recreate"):
+   """
+   Sum the FThist spectra of all runs weighted by their FIhist
+   sample counts, and write the averages to mergedfile.
+   """
+   import ROOT
+   sums = {}
+   counts = {}
+   for outfile in outfiles:
+      f = ROOT.TFile(outfile)
+      for var in spectra:
+         ft = f.Get(var + "ft")
+         no = f.Get(var + "no")
+         if not ft or not no:
+            print "merge_spectra warning -", var,
+            print "spectra not found in", outfile, "skipping"
+            continue
+         weighted = ft.Clone(var + "ft_weighted")
+         weighted.SetDirectory(0)
+         weighted.Multiply(no)
+         if var in sums:
+            sums[var].Add(weighted)
+            counts[var].Add(no)
+         else:
+            sums[var] = weighted
+            counts[var] = no.Clone()
+            counts[var].SetDirectory(0)
+      f.Close()
+   fout = ROOT.TFile(mergedfile, mode)
+   for var in spectra:
+      if var in sums:
+         sums[var].Divide(counts[var])
+         sums[var].SetName(var + "ft")
+         sums[var].Write()
+         counts[var].Write()
+   fout.Close()
+
+def main():
+   parser = argparse.ArgumentParser(description="run ACtree over many " +
+                                    "raw active collimator tree files")
+   parser.add_argument("rawfiles", nargs="+",
+                       help="ac_YYYYMMDD_hhmmss.root files or globs")
+   parser.add_argument("-j", "--jobs", type=int,
+                       default=multiprocessing.cpu_count(),
+                       help="number of runs to process at once")
+   parser.add_argument("-c", "--chunks", type=int, default=1,
+                       help="number of entry ranges to split each run into")
+   parser.add_argument("-d", "--outdir", default=".",
+                       help="directory for the serialized outputs")
+   parser.add_argument("-o", "--merged", default="ac_merged_spectra.root",
+                       help="output file for the merged spectra")
+   parser.add_argument("-O", "--options", default="",
+                       help="extra options passed to ACtree, eg. block")
+   args = parser.parse_args()
+
+   rawfiles = []
+   for pattern in args.rawfiles:
+      matches = sorted(glob.glob(pattern))
+      if len(matches) == 0:
+         print "ACbatch error - no input files match", pattern
+         sys.exit(1)
+      rawfiles += matches
+   outfiles = [serial_name(rawfile, args.outdir) for rawfile in rawfiles]
+   if len(set(outfiles)) < len(outfiles):
+      print "ACbatch error - two input runs have the same file name,",
+      print "cannot continue!"
+      sys.exit(1)
+
+   if compile_selector() != 0:
+      print "ACbatch error - ACtree.C failed to compile,",
+      print "see ACtree_build.log"
+      sys.exit(1)
+   pool = multiprocessing.Pool(args.jobs)
+   failed = set()
+   summaries = [(rawfile, args.outdir) for rawfile in rawfiles]
+   for rawfile, logfile, res in pool.imap_unordered(summary_job, summaries):
+      if res != 0:
+         print "ACbatch error - summary of", rawfile, "failed,",
+         print "see", logfile
+         failed.add(rawfile)
+   alignfiles = [align_name(outfile) for outfile in outfiles]
+   if args.chunks > 1:
+      aligns = [(rawfile, alignfile)
+                for rawfile, alignfile in zip(rawfiles, alignfiles)
+                if not rawfile in failed]
+      for rawfile, alignfile, res in pool.imap_unordered(build_alignment,
+                                                         aligns):
+         if res != 0 or not os.path.exists(alignfile):
+            print "ACbatch error - alignment of", rawfile, "failed,",
+            print "see", alignfile[:-5] + ".log"
+            failed.add(rawfile)
+   jobs = []
+   chunks = {}
+   for rawfile, outfile, alignfile in zip(rawfiles, outfiles, alignfiles):
+      if rawfile in failed:
+         continue
+      options = args.options + " align=" + alignfile
+      if args.chunks > 1:
+         chunks[rawfile] = chunk_jobs(rawfile, outfile, options,
+                                      args.chunks)
+         jobs += chunks[rawfile]
+      else:
+         jobs.append((rawfile, outfile, options, 0, 0))
+   for rawfile, outfile, res in pool.imap_unordered(process_run, jobs):
+      if res == 0 and os.path.exists(outfile):
+         print rawfile, "->", outfile
+      else:
+         print "ACbatch error - processing of", rawfile, "failed,",
+         print "see", outfile[:-5] + ".log"
+         failed.add(rawfile)
+   pool.close()
+   pool.join()
+   done = []
+   for rawfile, outfile in zip(rawfiles, outfiles):
+      if rawfile in failed:
+         continue
+      if rawfile in chunks:
+         merge_chunks([job[1] for job in chunks[rawfile]], outfile)
+         print rawfile, "chunks merged into", outfile
+      done.append(outfile)
+   if len(done) > 0:
+      merge_spectra(sorted(done), args.merged)
+      print "merged spectra from", len(done), "runs written to", args.merged
+
+if __name__ == "__main__":
+   main()
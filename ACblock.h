@@ -0,0 +1,121 @@
+//////////////////////////////////////////////////////////
+// ACblock.h - block-oriented layout of the ACtree serialized
+//             stream, and a reader that hands the blocks back
+//             one sample at a time.
+//
+// author: richard.t.jones at uconn.edu
+// version: october 18, 2026
+//
+// In block mode (ACtree option "block") the act tree holds one
+// entry per sampling interval instead of one per fadc sample:
+//    block  - trs/D:dtrs/D:cur/F:gva/F:nsam/I
+//             trs is the time of the first sample, dtrs the
+//             sample period and nsam the number of samples
+//    ixp ... oym - the baseline-subtracted wedge currents,
+//             one [8192]/F array per wedge
+// Sample n of a block is at time trs + n * dtrs.
+//////////////////////////////////////////////////////////
+
+#ifndef ACblock_h
+#define ACblock_h
+
+#include <vector>
+#include <algorithm>
+
+#include <TTree.h>
+#include <TBranch.h>
+#include <TString.h>
+
+struct acblock_t {
+   double trs;
+   double dtrs;
+   float cur;
+   float gva;
+   int nsam;
+   float wave[8][8192];
+};
+#define AC_BLOCK_FORM "trs/D:dtrs/D:cur/F:gva/F:nsam/I"
+
+static const char *ac_block_wedges[8] = {"ixp", "ixm", "iyp", "iym",
+                                         "oxp", "oxm", "oyp", "oym"};
+
+// one sample of the stream, same fields as ACtree::ac_t
+struct acsample_t {
+   double trs;
+   float ixp;
+   float ixm;
+   float iyp;
+   float iym;
+   float oxp;
+   float oxm;
+   float oyp;
+   float oym;
+   float cur;
+   float gva;
+};
+
+class ACblockReader {
+ public:
+   ACblockReader(TTree *tree);
+   ~ACblockReader() { delete fBlock; }
+
+   Long64_t GetSamples() const { return fFirst.back(); }
+   Long64_t GetFirstSample(Long64_t block) const { return fFirst[block]; }
+   Int_t GetBlockSamples(Long64_t block) const {
+      return fFirst[block + 1] - fFirst[block];
+   }
+   Bool_t GetSample(Long64_t n, acsample_t &sample);
+
+ private:
+   TTree *fTree;
+   acblock_t *fBlock;
+   Long64_t fLoaded;
+   std::vector<Long64_t> fFirst;
+};
+
+inline ACblockReader::ACblockReader(TTree *tree)
+ : fTree(tree),
+   fBlock(new acblock_t),
+   fLoaded(-1),
+   fFirst(1, 0)
+{
+   // Only the small block header branch is read here, to index the
+   // sample numbers; the wedge arrays are loaded on demand.
+
+   fTree->SetBranchAddress("block", &fBlock->trs);
+   for (int i=0; i < 8; ++i)
+      fTree->SetBranchAddress(ac_block_wedges[i], fBlock->wave[i]);
+   TBranch *header = fTree->GetBranch("block");
+   Long64_t nblocks = fTree->GetEntries();
+   for (Long64_t b=0; b < nblocks; ++b) {
+      header->GetEntry(b);
+      fFirst.push_back(fFirst.back() + fBlock->nsam);
+   }
+}
+
+inline Bool_t ACblockReader::GetSample(Long64_t n, acsample_t &sample)
+{
+   // Samples outside the stream come back zeroed, with status false,
+   // so they never carry the values of the previous sample.
+
+   if (n < 0 || n >= GetSamples()) {
+      sample = acsample_t();
+      return false;
+   }
+   Long64_t block = std::upper_bound(fFirst.begin(), fFirst.end(), n)
+                    - fFirst.begin() - 1;
+   if (block != fLoaded) {
+      fTree->GetEntry(block);
+      fLoaded = block;
+   }
+   int j = n - fFirst[block];
+   sample.trs = fBlock->trs + j * fBlock->dtrs;
+   float *currents = &sample.ixp;
+   for (int i=0; i < 8; ++i)
+      currents[i] = fBlock->wave[i][j];
+   sample.cur = fBlock->cur;
+   sample.gva = fBlock->gva;
+   return true;
+}
+
+#endif
@@ -0,0 +1,136 @@
+//////////////////////////////////////////////////////////
+// ACfft.h - batched real fast fourier transform used by the
+//           ACtree selector to compute the spectra of all of
+//           the wedge waveforms in a sampling interval together.
+//
+// author: richard.t.jones at uconn.edu
+// version: october 18, 2026
+//
+// The real waveforms are packed two at a time into the real
+// and imaginary parts of one complex sequence, so the 8 wedges
+// cost only 4 complex radix-2 transforms. The butterflies of
+// all of the packed sequences share a single pass over the
+// twiddle table. The length must be a power of 2.
+//
+// Convention: X[k] = sum_t x[t] exp(-2 pi i k t / N)
+//////////////////////////////////////////////////////////
+
+#ifndef ACfft_h
+#define ACfft_h
+
+#include <vector>
+#include <math.h>
+
+class ACfft {
+ public:
+   ACfft(int npoints, int nseries);
+   ~ACfft() { }
+
+   // transform nseries real waveforms in[s][0..npoints-1]
+   void Transform(const float *const *in);
+
+   // spectrum of series s at frequency index k, 0 <= k <= npoints/2
+   double Re(int s, int k) const { return fXre[s][k]; }
+   double Im(int s, int k) const { return fXim[s][k]; }
+
+   int GetN() const { return fN; }
+   int GetNseries() const { return fNseries; }
+
+ private:
+   int fN;
+   int fNseries;
+   int fNpacked;
+   std::vector<int> fRev;
+   std::vector<double> fCos;
+   std::vector<double> fSin;
+   std::vector<std::vector<double> > fZre;
+   std::vector<std::vector<double> > fZim;
+   std::vector<std::vector<double> > fXre;
+   std::vector<std::vector<double> > fXim;
+};
+
+inline ACfft::ACfft(int npoints, int nseries)
+ : fN(npoints),
+   fNseries(nseries),
+   fNpacked((nseries + 1) / 2),
+   fRev(npoints),
+   fCos(npoints / 2),
+   fSin(npoints / 2),
+   fZre(fNpacked, std::vector<double>(npoints)),
+   fZim(fNpacked, std::vector<double>(npoints)),
+   fXre(nseries, std::vector<double>(npoints / 2 + 1)),
+   fXim(nseries, std::vector<double>(npoints / 2 + 1))
+{
+   int nbits = 0;
+   while ((1 << nbits) < fN)
+      ++nbits;
+   for (int i=0; i < fN; ++i) {
+      int r = 0;
+      for (int b=0; b < nbits; ++b)
+         r |= ((i >> b) & 1) << (nbits - 1 - b);
+      fRev[i] = r;
+   }
+   for (int k=0; k < fN / 2; ++k) {
+      fCos[k] = cos(2 * M_PI * k / fN);
+      fSin[k] = -sin(2 * M_PI * k / fN);
+   }
+}
+
+inline void ACfft::Transform(const float *const *in)
+{
+   // pack pairs of series into complex sequences in bit-reversed order
+   for (int p=0; p < fNpacked; ++p) {
+      const float *a = in[2*p];
+      const float *b = (2*p + 1 < fNseries)? in[2*p + 1] : 0;
+      double *zre = &fZre[p][0];
+      double *zim = &fZim[p][0];
+      for (int t=0; t < fN; ++t) {
+         zre[fRev[t]] = a[t];
+         zim[fRev[t]] = (b)? b[t] : 0;
+      }
+   }
+
+   // iterative radix-2 butterflies, all packed sequences per twiddle
+   for (int len=2; len <= fN; len <<= 1) {
+      int half = len >> 1;
+      int step = fN / len;
+      for (int j=0; j < half; ++j) {
+         double wr = fCos[j * step];
+         double wi = fSin[j * step];
+         for (int p=0; p < fNpacked; ++p) {
+            double *zre = &fZre[p][0];
+            double *zim = &fZim[p][0];
+            for (int i=j; i < fN; i += len) {
+               int m = i + half;
+               double tr = wr * zre[m] - wi * zim[m];
+               double ti = wr * zim[m] + wi * zre[m];
+               zre[m] = zre[i] - tr;
+               zim[m] = zim[i] - ti;
+               zre[i] += tr;
+               zim[i] += ti;
+            }
+         }
+      }
+   }
+
+   // separate the spectra of the two real series in each packed pair,
+   //    A[k] = (Z[k] + conj(Z[N-k])) / 2
+   //    B[k] = (Z[k] - conj(Z[N-k])) / 2i
+   for (int p=0; p < fNpacked; ++p) {
+      const double *zre = &fZre[p][0];
+      const double *zim = &fZim[p][0];
+      int sa = 2*p;
+      int sb = 2*p + 1;
+      for (int k=0; k <= fN / 2; ++k) {
+         int nk = (fN - k) % fN;
+         fXre[sa][k] = (zre[k] + zre[nk]) / 2;
+         fXim[sa][k] = (zim[k] - zim[nk]) / 2;
+         if (sb < fNseries) {
+            fXre[sb][k] = (zim[k] + zim[nk]) / 2;
+            fXim[sb][k] = (zre[nk] - zre[k]) / 2;
+         }
+      }
+   }
+}
+
+#endif
@@ -9,6 +9,7 @@
 #define ACtree_h
 
 #include <string>
+#include <vector>
 
 #include <TROOT.h>
 #include <TChain.h>
@@ -18,8 +19,12 @@
 #include <TTreeReader.h>
 #include <TTreeReaderValue.h>
 #include <TTreeReaderArray.h>
+#include <TObjArray.h>
+#include <TObjString.h>
 
 // Headers needed by this particular selector
+#include "ACfft.h"
+#include "ACblock.h"
 
 
 class ACtree : public TSelector {
@@ -41,6 +46,11 @@ public :
    TH1D *FThist[8];
    TH1D *FTwork[8][2];
 
+   // Batched real fft engine for the 8 wedge waveforms,
+   // legacy_dft selects the original per-bin sum (option "dft")
+   ACfft *fft = 0;
+   Bool_t legacy_dft = false;
+
    // Output tree serializes the parallel data streams
    struct ac_t {
       double trs;
@@ -56,10 +66,30 @@ public :
       float gva;
    } ac_serial;
 #  define AC_FORM "trs/D:ixp/F:ixm/F:iyp/F:iym/F:oxp/F:oxm/F:oyp/F:oym/F:cur/F:gva/F"
+
+   // Alternative block output, one entry per record (option "block")
+   acblock_t ac_block;
+   Bool_t block_output = false;
+
    TTree *actree;
    TFile *acfile;
    Long64_t tbases = -1;
 
+   // Alignment table built by BuildAlignment() from the timestamps
+   // of the 8 trees: align[i][entry] is the entry of tree i that was
+   // recorded together with N9:raw_XP entry, or -1 for a gap. It is
+   // kept in align_file if one is given (option align=<file>).
+   std::vector<Long64_t> align[8];
+   std::vector<Float_t> beam_current;  // per N9:raw_XP entry (nA)
+   std::vector<double> tshift[8];      // per N9:raw_XP entry (s)
+   TString align_file;
+
+   // Records skipped by Process without reading their waveforms
+   Long64_t gated_records = 0;
+
+   // First entry seen by Process, WarmUp() runs if it is not 0
+   Long64_t first_entry = -1;
+
    ACtree(TTree * /*tree*/ =0) { }
    virtual ~ACtree() { }
    virtual Int_t   Version() const { return 2; }
@@ -77,6 +107,11 @@ public :
    virtual TList  *GetOutputList() const { return fOutput; }
    virtual void    SlaveTerminate();
    virtual void    Terminate();
+   virtual void    BuildAlignment();
+   virtual Bool_t  LoadAlignment();
+   virtual void    SaveAlignment();
+   virtual void    UpdateBaselines();
+   virtual void    WarmUp(Long64_t entry);
 
    ClassDef(ACtree,0);
 
@@ -111,6 +146,21 @@ void ACtree::Init(TTree *tree)
       }
       fTree[i]->SetBranchAddress("record", &rec[i].tsec);
    }
+
+   // Init may be called on its own to write the alignment file,
+   // without SlaveBegin, so the align=<file> option is picked up here
+   TObjArray *opts = TString(GetOption()).Tokenize(" ,");
+   for (int i=0; i < opts->GetEntries(); ++i) {
+      TString opt(((TObjString*)opts->At(i))->GetString());
+      if (opt.BeginsWith("align="))
+         align_file = opt(6, opt.Length());
+   }
+   delete opts;
+   if (align_file.Length() == 0 || !LoadAlignment()) {
+      BuildAlignment();
+      if (align_file.Length() > 0)
+         SaveAlignment();
+   }
 }
 
 Bool_t ACtree::Notify()
@@ -4,17 +4,23 @@
 #             raw active collimator tree file.
 #
 # author: richard.t.jones at uconn.edu
-# version: april 28, 2018
+# version: october 18, 2026
 
 if [[ $# != 1 || ! -r $1 ]]; then
     echo "Usage: ./ACtree.sh <ac_YYYYMMDD_hhmmss.root>"
     exit 1
 fi
 
+out=`basename $1 | sed 's/.root$/_serial.root/'`
+align=`basename $1 | sed 's/.root$/_align.root/'`
+# ACtree reads the record timestamps and currents from the summary
+# sidecar, so make it or bring it up to date first
+if ! python `dirname $0`/acsummary.py $1; then
+    echo "ACtree.sh error - acsummary.py failed on $1, cannot continue!"
+    exit 1
+fi
 root -l $1 <<EOI
 TTree *t = (TTree*)gROOT->FindObject("N9:raw_XP");
-t->Process("ACtree.C+O")
+t->Process("ACtree.C+O", "out=$out align=$align")
 .q
 EOI
-
-mv ac_serial.root `basename $1 | sed 's/.root$/_serial.root/'`
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#
+# accal.py - store of active collimator calibration constants with
+#            time intervals of validity, held as compact arrays for
+#            fast lookup by time, gain and wedge.
+#
+# author: richard.t.jones at uconn.edu
+# version: october 18, 2026
+#
+# usage:
+#    import accal
+#    accal.add_set(0, None, {"E": calparamE, "F": calparamF, ...})
+#    accal.load("accal.json")
+#    consts = accal.lookup(tsec, 1e10)           # one time
+#    cal = accal.acpos_calibration(times, gains)  # a whole time series
+#
+# notes:
+# 1) A calibration set holds the constants of the parameters in
+#    wedge_params for each of the gains in gains and each of the wedges
+#    in wedges, and those in axis_params for each gain and each of the
+#    axes in acpos.axes. It is valid from its start time up to (not
+#    including) its end time, in epoch seconds, or forever if end is
+#    None. It is built from the same nested dicts keyed [gain][wedge]
+#    or [gain][axis] that live.py uses.
+# 2) A set that is added later takes precedence over the earlier ones
+#    within its interval. The store keeps a timeline of disjoint
+#    segments, each pointing to the set that is valid there, so the
+#    lookup of a time is a binary search.
+# 3) The calibration file is a json list of entries
+#       {"start": <epoch>, "end": <epoch or null>, "gain": 1e10,
+#        "E": {"ixp": 0.01203, ...}, "F": {...}, "R": {"ix": 1.442, ...}}
+#    with one entry per gain of each set; constants that are not given
+#    are nan.
+
+import numpy
+import json
+
+import acpos
+
+wedges = ["ixp", "ixm", "iyp", "iym", "oxp", "oxm", "oyp", "oym"]
+gains = [1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12]
+wedge_params = ["ped", "gped", "E", "F", "G"]
+axis_params = ["P", "Q", "R", "S"]
+
+# column of each wedge or axis in the arrays of its parameters
+index = dict((wedges[n], n) for n in range(0, len(wedges)))
+index.update(acpos.axis_index)
+params = dict([(p, wedges) for p in wedge_params] +
+              [(p, acpos.axes) for p in axis_params])
+
+# constants of set n are sets[param][n, gain index, wedge or axis index]
+sets = dict((p, numpy.zeros((0, len(gains), len(params[p]))))
+            for p in params)
+
+# timeline of disjoint segments [seg_start, seg_end) using set seg_set
+seg_start = numpy.zeros(0)
+seg_end = numpy.zeros(0)
+seg_set = numpy.zeros(0, dtype=int)
+
+# (start, end, gain, constants) of the segment found by the last lookup,
+# so that a run of lookups at times within one segment, like those of
+# live.wedge_position for successive records, skips the search
+last_lookup = None
+
+def gain_index(gain):
+   """
+   Return the index in gains of gain, or of each gain in an array.
+   """
+   g = numpy.asarray(gain, dtype=float)
+   n = numpy.searchsorted(gains, g * (1 - 1e-6))
+   n = numpy.minimum(n, len(gains) - 1)
+   if not numpy.all(numpy.abs(numpy.take(gains, n) - g) <= 1e-6 * g):
+      raise ValueError("accal.gain_index - unknown gain {0}".format(gain))
+   return n
+
+def add_set(start, end, consts):
+   """
+   Add a calibration set valid in [start, end), end=None for ever,
+   with consts a dict param -> {gain: {wedge or axis: value}}, and
+   return its set number. Constants that are not given are nan.
+   """
+   global seg_start, seg_end, seg_set
+   global last_lookup
+   last_lookup = None
+   nset = sets["E"].shape[0]
+   for p in params:
+      block = numpy.empty((1, len(gains), len(params[p])))
+      block.fill(numpy.nan)
+      for gain in consts.get(p, {}):
+         for key in consts[p][gain]:
+            block[0, gain_index(gain), index[key]] = consts[p][gain][key]
+      sets[p] = numpy.concatenate((sets[p], block))
+   if end is None:
+      end = numpy.inf
+   segments = []
+   for s0, s1, n in zip(seg_start, seg_end, seg_set):
+      if s0 < start:
+         segments.append((s0, min(s1, start), n))
+      if s1 > end:
+         segments.append((max(s0, end), s1, n))
+   segments.append((start, end, nset))
+   segments.sort()
+   seg_start = numpy.array([s[0] for s in segments], dtype=float)
+   seg_end = numpy.array([s[1] for s in segments], dtype=float)
+   seg_set = numpy.array([s[2] for s in segments], dtype=int)
+   return nset
+
+def load(calfile):
+   """
+   Add the calibration sets in json file calfile to the store.
+   """
+   entries = json.load(open(calfile))
+   bysets = {}
+   for entry in entries:
+      key = (entry["start"], entry.get("end"))
+      if not key in bysets:
+         bysets[key] = {}
+      for p in params:
+         if p in entry:
+            bysets[key].setdefault(p, {})[entry["gain"]] = entry[p]
+   for key in sorted(bysets):
+      add_set(key[0], key[1], bysets[key])
+
+def save(calfile):
+   """
+   Write the sets of the store that are still in use to calfile.
+   """
+   entries = []
+   done = set()
+   for n in seg_set:
+      if n in done:
+         continue
+      done.add(n)
+      # the original interval of a set is the span of its segments
+      start = seg_start[seg_set == n].min()
+      end = seg_end[seg_set == n].max()
+      for ng in range(0, len(gains)):
+         entry = {"start": start, "end": None if end == numpy.inf else end,
+                  "gain": gains[ng]}
+         for p in params:
+            vals = sets[p][n, ng]
+            entry[p] = dict((params[p][k], vals[k])
+                            for k in range(0, len(vals))
+                            if not numpy.isnan(vals[k]))
+         if max(len(entry[p]) for p in params) > 0:
+            entries.append(entry)
+   json.dump(entries, open(calfile, "w"), indent=1)
+
+def find_sets(t):
+   """
+   Return the set number valid at time t (or an array of them for an
+   array of times), -1 where no set is valid.
+   """
+   t = numpy.asarray(t, dtype=float)
+   n = numpy.searchsorted(seg_start, t, side="right") - 1
+   valid = (n >= 0)
+   if len(seg_set) == 0:
+      return numpy.where(valid, -1, -1)
+   n = numpy.maximum(n, 0)
+   valid &= (t < seg_end[n])
+   return numpy.where(valid, seg_set[n], -1)
+
+def lookup(t, gain):
+   """
+   Return a dict param -> array of the constants valid at time t for
+   gain, indexed like wedges or acpos.axes, or None if no calibration
+   is valid at t. The dict is shared by the lookups of all times in the
+   same segment, and must not be modified.
+   """
+   global last_lookup
+   last = last_lookup
+   if last and last[2] == gain and last[0] <= t < last[1]:
+      return last[3]
+   k = numpy.searchsorted(seg_start, t, side="right") - 1
+   if k < 0 or t >= seg_end[k]:
+      return None
+   n = seg_set[k]
+   ng = int(gain_index(gain))
+   consts = dict((p, sets[p][n, ng]) for p in params)
+   last_lookup = (seg_start[k], seg_end[k], gain, consts)
+   return consts
+
+def lookup_series(times, gain):
+   """
+   Return a dict param -> array [sample, wedge or axis] of the constants
+   valid at each of times for gain (a value or an array of the same
+   length), with nan where no calibration is valid.
+   """
+   n = find_sets(numpy.ravel(times))
+   ng = gain_index(gain) * numpy.ones(len(n), dtype=int)
+   consts = {}
+   for p in params:
+      if sets[p].shape[0] > 0:
+         vals = sets[p][numpy.maximum(n, 0), ng]
+      else:
+         vals = numpy.zeros((len(n), len(params[p])))
+      vals[n < 0] = numpy.nan
+      consts[p] = vals
+   return consts
+
+def acpos_calibration(times, gain):
+   """
+   Return the constants valid at times for gain in the form used by
+   acpos.reconstruct, arrays [sample, axis, 0 for p, 1 for m].
+   """
+   consts = lookup_series(times, gain)
+   cal = {}
+   for p in ("ped", "E", "F", "G"):
+      cal[p] = consts[p].reshape(-1, len(acpos.axes), 2)
+   return cal
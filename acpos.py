@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# acpos.py - vectorized reconstruction of the beam position from the
+#            currents of opposite pairs of active collimator wedges,
+#            using the G,F,E quadratic calibration.
+#
+# author: richard.t.jones at uconn.edu
+# version: october 18, 2026
+#
+# usage:
+#    import acpos
+#    cal = acpos.calibration(g, calparamE, calparamF, calparamG, pedestals)
+#    x, valid = acpos.reconstruct(Ip, Im, cal, "ix")
+#
+# For the pedestal-subtracted currents Ip, Im of the p and m wedges of
+# an axis (ix, iy, ox, oy) the position x solves
+#    A x^2 + B x + C = 0
+# with A = Ip * E_m - Im * E_p, B = Ip * F_m - Im * F_p, and
+# C = Ip * G_m - Im * G_p, taking the root x = (-B - sqrt(D)) / 2A where
+# D = B^2 - 4AC. Samples with D <= 0 (or with too little signal, if a
+# min_signal is given) are marked as not valid and their x is nan.
+# Ip and Im can be scalars or arrays of any shape, and so can the
+# calibration constants, as long as they broadcast together.
+
+import numpy
+
+axes = ["ix", "iy", "ox", "oy"]
+axis_index = dict((axes[n], n) for n in range(0, len(axes)))
+
+def calibration(key, calparamE, calparamF, calparamG, pedestals=None):
+   """
+   Assemble the E, F, G constants (and optionally the pedestals) of
+   calibration set key, a gain or a scan number, from the nested dicts
+   used by live.py and scans.py into arrays indexed [axis, 0 for p,
+   1 for m], with the axes in the order of acpos.axes.
+   """
+   cal = {}
+   params = {"E": calparamE, "F": calparamF, "G": calparamG}
+   if pedestals is not None:
+      params["ped"] = pedestals
+   for name in params:
+      cal[name] = numpy.array([[params[name][key][axis + "p"],
+                                params[name][key][axis + "m"]]
+                               for axis in axes], dtype=float)
+   if not "ped" in cal:
+      cal["ped"] = numpy.zeros((len(axes), 2))
+   return cal
+
+def solve(Ip, Im, Ep, Em, Fp, Fm, Gp, Gm, min_signal=None):
+   """
+   Solve the quadratic for pedestal-subtracted currents Ip, Im, and
+   return the arrays (x, valid).
+   """
+   Ip = numpy.asarray(Ip, dtype=float)
+   Im = numpy.asarray(Im, dtype=float)
+   A = Ip * Em - Im * Ep
+   B = Ip * Fm - Im * Fp
+   C = Ip * Gm - Im * Gp
+   D = B**2 - 4 * A * C
+   valid = (D > 0) & (A != 0)
+   if min_signal is not None:
+      valid &= (Ip + Im > min_signal)
+   with numpy.errstate(invalid='ignore', divide='ignore'):
+      x = numpy.where(valid, (-B - numpy.sqrt(numpy.where(valid, D, 0)))
+                             / (2 * A), numpy.nan)
+   return x, valid
+
+def reconstruct(Ip, Im, cal, axis, min_signal=None):
+   """
+   Reconstruct the position along axis from the raw currents Ip, Im
+   of its p and m wedges, subtracting the pedestals in cal.
+   """
+   n = axis_index[axis]
+   Ip = numpy.asarray(Ip, dtype=float) - cal["ped"][..., n, 0]
+   Im = numpy.asarray(Im, dtype=float) - cal["ped"][..., n, 1]
+   return solve(Ip, Im,
+                cal["E"][..., n, 0], cal["E"][..., n, 1],
+                cal["F"][..., n, 0], cal["F"][..., n, 1],
+                cal["G"][..., n, 0], cal["G"][..., n, 1], min_signal)
+
+def reconstruct_all(currents, cal, min_signal=None):
+   """
+   Reconstruct all of the axes from a dict of raw wedge currents keyed
+   ixp, ixm, ... oym, returning a dict axis -> (x, valid).
+   """
+   pos = {}
+   for axis in axes:
+      if axis + "p" in currents and axis + "m" in currents:
+         pos[axis] = reconstruct(currents[axis + "p"], currents[axis + "m"],
+                                 cal, axis, min_signal)
+   return pos
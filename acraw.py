@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# acraw.py - chunked reader for the raw N9/N10 wedge trees written
+#            by the AC recorder, returning the records as numpy arrays.
+#
+# author: richard.t.jones at uconn.edu
+# version: october 18, 2026
+#
+# usage:
+#    import acraw
+#    chains = acraw.open_chains(["data/ac_20200821_185034.root"])
+#    for chunk in acraw.read_chunks(chains["ixp"], chunksize=500):
+#       means = chunk["data"].mean(axis=1)
+#       ...
+#
+# Each chunk is a dict of arrays for n consecutive entries of a tree,
+#    tsec    - int64[n] epoch seconds
+#    tnsec   - int64[n] nanoseconds
+#    current - float32[n] beam current (nA)
+#    gain    - int16[n] log10 of the preamp gain - 6
+#    data    - float32[n,8192] raw fadc waveform
+# so memory stays bounded by chunksize * 32kB per tree, however long
+# the chain is. The entries of a chunk are read and copied into its
+# arrays by the compiled helper acraw_fill, not entry by entry from
+# python.
+
+import numpy as np
+import ROOT
+
+chainvars = {"ixp": "N9:raw_XP",
+             "ixm": "N9:raw_XM",
+             "iyp": "N9:raw_YP",
+             "iym": "N9:raw_YM",
+             "oxp": "N10:raw_XP",
+             "oxm": "N10:raw_XM",
+             "oyp": "N10:raw_YP",
+             "oym": "N10:raw_YM",
+            }
+
+# layout of the "record" leaf list tsec/L:tnsec/L:data[8192]/F:current/F:gain/S
+record_dtype = np.dtype([("tsec", np.int64),
+                         ("tnsec", np.int64),
+                         ("data", np.float32, (8192,)),
+                         ("current", np.float32),
+                         ("gain", np.int16),
+                        ])
+
+# reads entries first .. first+n-1 of tree, whose "record" branch
+# address is rec, and copies each record into the column arrays
+acraw_fill_code = """
+#include <cstring>
+void acraw_fill(TTree *tree, void *rec, Long64_t first, Long64_t n,
+                void *tsec, void *tnsec, void *current, void *gain,
+                void *data)
+{
+   const size_t nsamp = 8192 * sizeof(Float_t);
+   const char *r = (const char*)rec;
+   for (Long64_t i=0; i < n; ++i) {
+      tree->GetEntry(first + i);
+      memcpy((char*)tsec + i * 8, r, 8);
+      memcpy((char*)tnsec + i * 8, r + 8, 8);
+      memcpy((char*)current + i * 4, r + 16 + nsamp, 4);
+      memcpy((char*)gain + i * 2, r + 20 + nsamp, 2);
+      if (data)
+         memcpy((char*)data + i * nsamp, r + 16, nsamp);
+   }
+}
+"""
+acraw_fill = None
+
+def fill_function():
+   """
+   Compile acraw_fill on first use and return it.
+   """
+   global acraw_fill
+   if acraw_fill is None:
+      ROOT.gInterpreter.Declare(acraw_fill_code)
+      acraw_fill = ROOT.acraw_fill
+   return acraw_fill
+
+def open_chains(rootfiles, prefix=""):
+   """
+   Return a dict of TChains, one per wedge, over the raw trees
+   in rootfiles.
+   """
+   chains = {}
+   for var in sorted(chainvars):
+      chains[var] = ROOT.TChain(chainvars[var])
+      for rootf in rootfiles:
+         chains[var].Add(prefix + rootf)
+   return chains
+
+def read_chunks(tree, chunksize=256, first=0, nentries=-1, data=True):
+   """
+   Generator over the entries first .. first+nentries-1 of a raw tree
+   or chain, yielding chunks of at most chunksize records as a dict
+   of numpy arrays. With data=False the waveforms are not copied out
+   and the chunks only carry the tsec, tnsec, current, gain columns.
+   """
+   entries = tree.GetEntries()
+   if nentries < 0 or first + nentries > entries:
+      nentries = entries - first
+   fill = fill_function()
+   buf = np.zeros(record_dtype.itemsize, dtype=np.uint8)
+   tree.SetBranchAddress("record", buf)
+   try:
+      for start in range(first, first + nentries, chunksize):
+         n = min(chunksize, first + nentries - start)
+         chunk = {"tsec": np.empty(n, dtype=np.int64),
+                  "tnsec": np.empty(n, dtype=np.int64),
+                  "current": np.empty(n, dtype=np.float32),
+                  "gain": np.empty(n, dtype=np.int16),
+                 }
+         if data:
+            chunk["data"] = np.empty((n, 8192), dtype=np.float32)
+         fill(tree, buf, start, n, chunk["tsec"], chunk["tnsec"],
+              chunk["current"], chunk["gain"],
+              chunk["data"] if data else ROOT.nullptr)
+         yield chunk
+   finally:
+      tree.ResetBranchAddresses()
+
+def read_wedges(chains, chunksize=256, data=True):
+   """
+   Generator over all of the wedge chains in turn, yielding
+   (var, chunk) pairs in sorted order of var.
+   """
+   for var in sorted(chains):
+      for chunk in read_chunks(chains[var], chunksize, data=data):
+         yield var, chunk
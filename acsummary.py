@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# acsummary.py - build and update compact per-record summary files
+#                alongside the raw active collimator tree files.
+#
+# author: richard.t.jones at uconn.edu
+# version: october 18, 2026
+#
+# usage:
+#          $ acsummary.py [-c <chunksize>] <ac_YYYYMMDD_hhmmss.root> ...
+#
+# notes:
+# 1) The summary of ac_YYYYMMDD_hhmmss.root is written next to it as
+#    ac_YYYYMMDD_hhmmss_summary.root, with one tree per wedge under
+#    the same name as the raw tree (N9:raw_XP ... N10:raw_YM) and one
+#    entry per raw record, holding the branches
+#       tsec/L tnsec/L current/F gain/S - copied from the record
+#       mean/F rms/F min/F max/F        - statistics of the 8192 samples
+#    so chains built on the summary files accept the same cuts on
+#    tsec, current and gain, with "mean" in place of Sum$(data)/8192.
+# 2) Running it again on a run that has grown since its summary was
+#    made only appends the summaries of the new records.
+
+import numpy as np
+import argparse
+import os
+import sys
+
+import ROOT
+import acraw
+
+branches = [("tsec", np.int64, "L"),
+            ("tnsec", np.int64, "L"),
+            ("current", np.float32, "F"),
+            ("gain", np.int16, "S"),
+            ("mean", np.float32, "F"),
+            ("rms", np.float32, "F"),
+            ("min", np.float32, "F"),
+            ("max", np.float32, "F"),
+           ]
+
+def summary_name(rawfile):
+   if rawfile.endswith(".root"):
+      rawfile = rawfile[:-5]
+   return rawfile + "_summary.root"
+
+def update_summary(rawfile, chunksize=500):
+   """
+   Bring the summary file of rawfile up to date with all of the
+   records in the raw trees, and return its name.
+   """
+   sumfile = summary_name(rawfile)
+   fin = ROOT.TFile(rawfile)
+   fout = ROOT.TFile(sumfile, "update")
+   for var in sorted(acraw.chainvars):
+      rawtree = fin.Get(acraw.chainvars[var])
+      if not rawtree:
+         print "acsummary warning - tree", acraw.chainvars[var],
+         print "not found in", rawfile
+         continue
+      buf = {}
+      for name, dtype, code in branches:
+         buf[name] = np.zeros(1, dtype=dtype)
+      tree = fout.Get(acraw.chainvars[var])
+      if tree:
+         for name, dtype, code in branches:
+            tree.SetBranchAddress(name, buf[name])
+      else:
+         fout.cd()
+         tree = ROOT.TTree(acraw.chainvars[var], "AC record summaries")
+         for name, dtype, code in branches:
+            tree.Branch(name, buf[name], name + "/" + code)
+      first = tree.GetEntries()
+      for chunk in acraw.read_chunks(rawtree, chunksize, first=first):
+         data = chunk["data"].astype(np.float64)
+         mean = data.mean(axis=1)
+         rms = data.std(axis=1)
+         low = data.min(axis=1)
+         high = data.max(axis=1)
+         for i in range(0, len(mean)):
+            buf["tsec"][0] = chunk["tsec"][i]
+            buf["tnsec"][0] = chunk["tnsec"][i]
+            buf["current"][0] = chunk["current"][i]
+            buf["gain"][0] = chunk["gain"][i]
+            buf["mean"][0] = mean[i]
+            buf["rms"][0] = rms[i]
+            buf["min"][0] = low[i]
+            buf["max"][0] = high[i]
+            tree.Fill()
+      if tree.GetEntries() > first:
+         print rawfile, acraw.chainvars[var], "summarized",
+         print tree.GetEntries() - first, "new records"
+      fout.cd()
+      tree.Write("", ROOT.TObject.kOverwrite)
+   fout.Close()
+   fin.Close()
+   return sumfile
+
+def read_summary(tree):
+   """
+   Read all of the entries of a summary tree or chain and return
+   them as a dict of numpy arrays, one per branch.
+   """
+   entries = tree.GetEntries()
+   buf = {}
+   cols = {}
+   for name, dtype, code in branches:
+      buf[name] = np.zeros(1, dtype=dtype)
+      cols[name] = np.empty(entries, dtype=dtype)
+      tree.SetBranchAddress(name, buf[name])
+   for i in range(0, entries):
+      tree.GetEntry(i)
+      for name in buf:
+         cols[name][i] = buf[name][0]
+   tree.ResetBranchAddresses()
+   return cols
+
+def open_chains(rawfiles, prefix="", update=True):
+   """
+   Return a dict of TChains, one per wedge, over the summary files
+   of the raw files in rawfiles, like acraw.open_chains does for
+   the raw trees. With update=True the summaries are brought up to
+   date first.
+   """
+   sumfiles = []
+   for rawfile in rawfiles:
+      if update:
+         sumfiles.append(update_summary(prefix + rawfile))
+      else:
+         sumfiles.append(summary_name(prefix + rawfile))
+   return acraw.open_chains(sumfiles)
+
+def main():
+   parser = argparse.ArgumentParser(description="build or update the " +
+                                    "per-record summaries of raw " +
+                                    "active collimator tree files")
+   parser.add_argument("rawfiles", nargs="+",
+                       help="ac_YYYYMMDD_hhmmss.root files")
+   parser.add_argument("-c", "--chunksize", type=int, default=500,
+                       help="number of records read at a time")
+   args = parser.parse_args()
+   for rawfile in args.rawfiles:
+      if not os.path.exists(rawfile):
+         print "acsummary error - input file", rawfile, "not found"
+         sys.exit(1)
+      print rawfile, "->", update_summary(rawfile, args.chunksize)
+
+if __name__ == "__main__":
+   main()
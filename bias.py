@@ -7,6 +7,7 @@
 # version: august 18, 2020
 
 import ROOT
+import acsummary
 
 vars = {"ixp": "N9:raw_XP",
         "ixm": "N9:raw_XM",
@@ -25,11 +26,20 @@ rootfiles = ["ac_20200808_170304.root",
              "ac_20200808_194804.root",
             ]
 
-chains = {}
-for var in vars:
-   chains[var] = ROOT.TChain(vars[var])
-   for rfile in rootfiles:
-      chains[var].Add(rfile)
+# Set summary = True to draw from the per-record summary files
+# made by acsummary.py instead of summing the raw waveforms.
+summary = False
+
+if summary:
+   chains = acsummary.open_chains(rootfiles)
+   level = "mean"
+else:
+   chains = {}
+   for var in vars:
+      chains[var] = ROOT.TChain(vars[var])
+      for rfile in rootfiles:
+         chains[var].Add(rfile)
+   level = "Sum$(data)/8192"
 
 colors = {"ixp": ROOT.kBlue,
           "ixm": ROOT.kRed,
@@ -74,7 +84,7 @@ def draw_raw16(test=0):
    for var in sorted(vars):
       ped = pedestals[var]
       chains[var].SetMarkerColor(colors[var])
-      chains[var].Draw("(Sum$(data)/8192-({0}))*100/current:tsec-({1})".format(ped, tstart),
+      chains[var].Draw("({0}-({1}))*100/current:tsec-({2})".format(level, ped, tstart),
                        cond, opt)
       htemp = ROOT.gPad.GetPrimitive("htemp")
       htemp.SetTitle("active collimator raw currents vs time")
@@ -101,7 +111,7 @@ def bias_raw16(test=0):
    for var in sorted(vars):
       ped = pedestals[var]
       chains[var].SetMarkerColor(colors[var])
-      chains[var].Draw("(Sum$(data)/8192-({0}))*100/current".format(ped) +
+      chains[var].Draw("({0}-({1}))*100/current".format(level, ped) +
                        ":" + Vbias, cond, opt)
       htemp = ROOT.gPad.GetPrimitive("htemp")
       htemp.SetTitle("active collimator raw currents vs bias")
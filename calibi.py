@@ -9,7 +9,8 @@
 
 import ROOT
 import numpy as np
-import statistics as stats
+import acraw
+import acsummary
 
 plots = {}
 plotranges = {2: {'log10xmin': 1.2,
@@ -34,6 +35,7 @@ log10ymin = -2
 log10ymax = 2
 
 pedestals = {}
+pedestal_stdevs = {}
 refradlen = 4.5e-4
 
 # This is for the scan taken on August 21, 2020
@@ -63,47 +65,94 @@ rootfiles = ["ac_20200821_185034.root",
              "ac_20200821_195048.root",
              "ac_20200802_075342.root",
             ]
-chains = {}
-for var in sorted(chainvars):
-   chains[var] = ROOT.TChain(chainvars[var])
-   for rootf in rootfiles:
-      chains[var].Add("data/" + rootf)
+# Set summary = True to take the record means from the per-record
+# summary files made by acsummary.py instead of the raw waveforms.
+summary = False
+
+if summary:
+   chains = acsummary.open_chains(rootfiles, prefix="data/")
+else:
+   chains = acraw.open_chains(rootfiles, prefix="data/")
+records = {}
+
+def load_records(var):
+   """
+   Read the chain for wedge var once and keep the per-record columns
+   tsec, current, gain and imean (the mean of the waveform) in the
+   records dict, shared by load_pedestals and make_plots.
+   """
+   if var in records:
+      return records[var]
+   if summary:
+      cols = acsummary.read_summary(chains[var])
+      records[var] = {"tsec": cols["tsec"],
+                      "current": cols["current"],
+                      "gain": cols["gain"],
+                      "imean": cols["mean"].astype(np.float64),
+                     }
+      return records[var]
+   cols = {"tsec": [], "current": [], "gain": [], "imean": []}
+   for chunk in acraw.read_chunks(chains[var], chunksize=500):
+      cols["tsec"].append(chunk["tsec"])
+      cols["current"].append(chunk["current"])
+      cols["gain"].append(chunk["gain"])
+      cols["imean"].append(chunk["data"].sum(axis=1, dtype=np.float64)
+                           / 8192.)
+   for col in cols:
+      cols[col] = np.concatenate(cols[col]) if len(cols[col]) else \
+                  np.zeros(0)
+   records[var] = cols
+   return cols
 
 def load_pedestals(gain, tmin=1598049000, tmax=1600000000):
+   """
+   Find the pedestals of all wedges for one gain or a list of gains,
+   reading each chain only once. The pedestal is the mean waveform
+   level of the beam-off records, skipping the first and last two
+   records of each beam-off trip. Returns the pedestals dict, with
+   the standard deviations stored in pedestal_stdevs.
+   """
    current_threshold = 0.3 # nA
-   pedestals[gain] = {}
+   try:
+      gainlist = list(gain)
+   except TypeError:
+      gainlist = [gain]
+   for g in gainlist:
+      pedestals[g] = {}
+      pedestal_stdevs[g] = {}
    for var in sorted(chains):
-      trips = []
-      current = 1
-      for i in range(0, chains[var].GetEntries()):
-         chains[var].GetEntry(i)
-         if chains[var].gain != gain:
-            continue
-         if chains[var].tsec < tmin or chains[var].tsec > tmax:
-            continue
-         if chains[var].current <= current_threshold:
-            imean = sum(chains[var].data) / 8192.
-            if current > 0:
-               trips.append([imean])
-               current = 0
-            else:
-               trips[-1].append(imean)
+      cols = load_records(var)
+      for g in gainlist:
+         sel = np.where((cols["gain"] == g) &
+                        (cols["tsec"] >= tmin) & (cols["tsec"] <= tmax))[0]
+         off = cols["current"][sel] <= current_threshold
+         imean = cols["imean"][sel][off]
+         # a trip starts at every beam-off record that follows a
+         # beam-on record, or at the first selected record
+         starts = off & np.concatenate(([True], ~off[:-1]))
+         trip = np.cumsum(starts)[off] - 1
+         if len(trip) > 0:
+            first = np.where(starts[off])[0]
+            ntrip = np.bincount(trip)
+            pos = np.arange(len(trip)) - first[trip]
+            peds = imean[(pos >= 2) & (pos < ntrip[trip] - 2)]
+         else:
+            peds = imean
+         if len(peds) > 0:
+            mean = np.mean(peds)
+            stdev = np.std(peds, ddof=1) if len(peds) > 1 else 0
+            pedestals[g][var] = mean
+            pedestal_stdevs[g][var] = stdev
+            print "pedestal at gain", g, "for", var, \
+                  "=", mean, "+/-", stdev
          else:
-            current = chains[var].current
-      peds = []
-      for trip in trips:
-        peds += trip[2:-2]
-      if len(peds) > 0:
-         pedestals[gain][var] = stats.mean(peds)
-         print "pedestal at gain", gain, "for", var, \
-               "=", stats.mean(peds), "+/-", stats.stdev(peds)
-      else:
-         print "no pedestal data found at gain", gain, "for", var
+            print "no pedestal data found at gain", g, "for", var
+   return pedestals
 
 def make_plots():
-   for gain in gains:
-      if not gain in pedestals:
-         load_pedestals(gain)
+   missing = [gain for gain in gains if not gain in pedestals]
+   if len(missing) > 0:
+      load_pedestals(missing)
    for var in sorted(chainvars):
       for gain in gains:
          name = "p" + var + "{0}".format(gain)
@@ -117,21 +166,29 @@ def make_plots():
          plots[name].SetDirectory(0)
          plots[name].SetStats(0)
          plots[name].SetLineColor(gain)
+      # all of the gains and radiators are booked from a single
+      # read of the chain, routing records by gain and tsec
+      cols = load_records(var)
+      for gain in gains:
+         name = "p" + var + "{0}".format(gain)
+         ped = pedestals[gain][var]
          for rad in radiators:
-            ped = pedestals[gain][var]
-            xvar = "log(current * ({0}))/log(10)".format(rad / refradlen)
-            yvar = "log(abs(Sum$(data)/8192-({0})))/log(10)".format(ped)
-            yvar += "+log({0})/log(10)".format(10 / 2048.)
-            yvar += "+log({0})/log(10)+9".format(gains[gain])
-            cond = "(current>3)&&(gain=={0})".format(gain)
-            cond += "&&(tsec>{0})".format(radiators[rad][0])
-            cond += "&&(tsec<{0})".format(radiators[rad][1])
-            hpro = plots[name].Clone("hpro")
-            chains[var].Draw(yvar + ":" + xvar + ">>hpro", cond)
-            plots[name].Add(hpro)
-            plots[name].SetTitle(title)
-            plots[name].Draw()
-            ROOT.gROOT.FindObject("c1").Update()
+            sel = np.where((cols["current"] > 3) & (cols["gain"] == gain) &
+                           (cols["tsec"] > radiators[rad][0]) &
+                           (cols["tsec"] < radiators[rad][1]))[0]
+            if len(sel) == 0:
+               continue
+            with np.errstate(divide='ignore'):
+               x = np.log10(cols["current"][sel].astype(np.float64) *
+                            (rad / refradlen))
+               y = np.log10(np.abs(cols["imean"][sel] - ped))
+            y += np.log10(10 / 2048.) + np.log10(gains[gain]) + 9
+            x = np.ascontiguousarray(x, dtype=np.float64)
+            y = np.ascontiguousarray(y, dtype=np.float64)
+            w = np.ones(len(sel), dtype=np.float64)
+            plots[name].FillN(len(sel), x, y, w)
+         plots[name].Draw()
+         ROOT.gROOT.FindObject("c1").Update()
 
 def color_plot(*wedges):
    if len(plots) == 0:
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 
 from ROOT import *
+import acsummary
+
+# Set summary = True to fill the profiles from the per-record summary
+# files made by acsummary.py instead of from every raw sample.
+summary = False
 
 gains = range(6,13)
 files = ["darkcurrent-8-15-2018/ac_20180815_1e{0}.root".format(g)
@@ -33,13 +38,25 @@ for i in range(0,4):
 
 def fillme():
    for i in range(0,7):
-      f = TFile(files[i])
+      if summary:
+         f = TFile(acsummary.update_summary(files[i]))
+      else:
+         f = TFile(files[i])
       for sector in sectors:
          ti = f.Get(inames[sector])
          to = f.Get(onames[sector])
          fout.cd()
-         ti.Draw("data:6+" + str(i) + ">>+i" + sector)
-         to.Draw("data:6+" + str(i) + ">>+o" + sector)
+         if summary:
+            # two entries at mean +/- rms with half of the 8192
+            # samples each carry the same sum and spread per record
+            for sign in ("+", "-"):
+               ti.Draw("mean" + sign + "rms:6+" + str(i) + ">>+i" + sector,
+                       "4096")
+               to.Draw("mean" + sign + "rms:6+" + str(i) + ">>+o" + sector,
+                       "4096")
+         else:
+            ti.Draw("data:6+" + str(i) + ">>+i" + sector)
+            to.Draw("data:6+" + str(i) + ">>+o" + sector)
 
 def tabulate():
    print "        ",
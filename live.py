@@ -9,10 +9,21 @@
 from ROOT import *
 import numpy
 
+from multiprocessing.pool import ThreadPool
 import mysql.connector
+import threading
 import datetime
+import sqlite3
+import Queue
+import json
+import collections
+import contextlib
+import myareplica
+import accal
+import acpos
 import time
 import sys
+import os
 import re
 
 gains = [1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12]
@@ -67,6 +78,18 @@ calparamE = {1e9: {"ixp": 0.01019, "ixm": 0.01340, "iyp": 0.01273, "iym": 0.0162
              1e11:{"ixp": 0.02288, "ixm": 0.02176, "iyp": 0.02278, "iym": 0.02170,
                    "oxp": 1.00000, "oxm": 1.00000, "oyp": 0.00910, "oym": 0.00998}}
 
+# The constants above are the default calibration, valid at all times,
+# in the calibration store kept by accal. Sets read from calibration_file,
+# if it exists, take precedence over them within their validity intervals.
+
+calibration_file = os.path.expanduser("~/.live_calibration.json")
+accal.add_set(0, None, {"ped": pedestals, "gped": gpedestal,
+                        "P": calparamP, "Q": calparamQ,
+                        "R": calparamR, "S": calparamS,
+                        "E": calparamE, "F": calparamF, "G": calparamG})
+if os.path.exists(calibration_file):
+   accal.load(calibration_file)
+
 epicsvars = {"ixp": "IOCHDCOL:VMICADC1_1",
              "ixm": "IOCHDCOL:VMICADC2_1",
              "iyp": "IOCHDCOL:VMICADC3_1",
@@ -110,98 +133,491 @@ myahost = [{"name":"opsmya0.acc.jlab.org",
            {"name":"opsmya8.acc.jlab.org",
             "proxy":"gluey.phys.uconn.edu", "port": 63314}]
 
+# index of each mya host by its short name, eg. "opsmya3" -> 3
+
+myaindex = {}
+for n in range(0, len(myahost)):
+   myaindex[myahost[n]["name"].split(".")[0]] = n
+
+# channel metadata cache, epics name -> [chan_id, host, nmya, lookup time],
+# kept in memory and saved to channel_cache_file between sessions;
+# entries older than channel_cache_ttl seconds are looked up again.
+
+channel_cache_file = os.path.expanduser("~/.live_channels.json")
+channel_cache_ttl = 7 * 24 * 3600
+channel_cache = {}
+
 # global variables
 
 epicsrecord = {}
-cnx = [0] * 9
+max_record_size = 20000  # rows of each var kept in epicsrecord
+
+# Archive rows fetched by plot() and get_epics_record are saved in the
+# local replica kept by myareplica, and read back from it whenever it
+# already covers the requested times.
+use_replica = True
+
+# plot() asks the archive for bucketed min/max/mean values instead of
+# the raw rows when one pixel of the plot_width wide chart spans more
+# than aggregate_min_bucket seconds.
+plot_width = 1000 # pixels
+aggregate_min_bucket = 5 # seconds
+
+# Connections to archive server n are made by connection_factory(n)
+# and kept in a pool of at most pool_size connections per host, so
+# that concurrent queries from fetch_epics_records each have their own.
+# A query waits at most pool_timeout seconds for a free connection.
+# Queries with parameters use paramstyle as the placeholder, so they
+# run against a local sqlite stand-in, see use_local_archive().
+
+pool_size = 4
+pool_timeout = 60 # seconds
+pools = {}
+pools_lock = threading.Lock()
+
+def mysql_factory(n):
+   # autocommit, so that a long-lived pooled connection does not keep
+   # reading the snapshot of its first query and miss new rows
+   return mysql.connector.connect(user='myapi', password='MYA',
+                                  host=myahost[n]["proxy"],
+                                  port=myahost[n]["port"],
+                                  database='archive',
+                                  autocommit=True)
 
-def mysql_connection(n):
-   if cnx[n] == 0:
-      cnx[n] = mysql.connector.connect(user='myapi', password='MYA',
-                                       host=myahost[n]["proxy"],
-                                       port=myahost[n]["port"],
-                                       database='archive')
-   return cnx[n]
+connection_factory = mysql_factory
+paramstyle = "%s"
+
+def use_local_archive(dbfile):
+   """
+   Direct all archive queries to the sqlite database dbfile, which
+   holds a channels (chan_id, name, host) table and one table_<chan_id>
+   (time, val1) table per channel, in place of the mya servers.
+   """
+   global connection_factory
+   global paramstyle
+   close_mysql_connections()
+   connection_factory = lambda n: sqlite3.connect(dbfile,
+                                                  check_same_thread=False)
+   paramstyle = "?"
+
+def acquire_connection(n):
+   """
+   Take a connection to archive server n from the pool of its host,
+   making a new one if fewer than pool_size are open, else waiting up
+   to pool_timeout seconds for one to be released. Use it through
+   archive_connection, which always gives it back.
+   """
+   host = myahost[n]["name"]
+   with pools_lock:
+      if not host in pools:
+         pools[host] = {"idle": Queue.LifoQueue(), "count": 0}
+      pool = pools[host]
+      try:
+         return pool["idle"].get_nowait()
+      except Queue.Empty:
+         if pool["count"] < pool_size:
+            pool["count"] += 1
+            create = True
+         else:
+            create = False
+   if create:
+      try:
+         return connection_factory(n)
+      except:
+         with pools_lock:
+            pool["count"] -= 1
+         raise
+   try:
+      return pool["idle"].get(timeout=pool_timeout)
+   except Queue.Empty:
+      raise RuntimeError("live.acquire_connection - no connection to " +
+                         "{0} free after {1} s".format(host, pool_timeout))
+
+def release_connection(n, c):
+   with pools_lock:
+      pool = pools.get(myahost[n]["name"])
+   if pool is None:
+      c.close()
+   else:
+      pool["idle"].put(c)
+
+def discard_connection(n, c):
+   """
+   Close a connection that failed in use instead of returning it to
+   the pool, making room for a new one.
+   """
+   with pools_lock:
+      pool = pools.get(myahost[n]["name"])
+      if pool is not None:
+         pool["count"] -= 1
+   try:
+      c.close()
+   except Exception:
+      pass
+
+@contextlib.contextmanager
+def archive_connection(n):
+   """
+   Lend a pooled connection to archive server n to the body of a with
+   statement. It goes back to the pool when the body completes, and
+   is discarded if the body raises, so a failed query never leaks it.
+   """
+   c = acquire_connection(n)
+   try:
+      yield c
+   except:
+      discard_connection(n, c)
+      raise
+   release_connection(n, c)
 
 def close_mysql_connections():
-   for c in cnx:
-      if c:
-         c.close()
+   with pools_lock:
+      for host in pools:
+         while True:
+            try:
+               pools[host]["idle"].get_nowait().close()
+            except Queue.Empty:
+               break
+      pools.clear()
 
-def update_epics_record(var, nmax=1000, stime=0):
-   mya0 = mysql_connection(0)
-   cursor = mya0.cursor()
-   query = "SELECT chan_id, host FROM channels WHERE name = %s"
-   cursor.execute(query, (epicsvars[var],))
+def load_channel_cache():
+   global channel_cache
+   try:
+      channel_cache = json.load(open(channel_cache_file))
+   except (IOError, ValueError):
+      channel_cache = {}
+
+def save_channel_cache():
+   try:
+      json.dump(channel_cache, open(channel_cache_file, "w"))
+   except IOError:
+      print "save_channel_cache warning -",
+      print "cannot write", channel_cache_file
+
+def lookup_channel(var):
+   """
+   Return (chan_id, nmya) for epics variable var, where nmya is the
+   index in myahost of the archive server holding its table. The
+   channels table on opsmya0 is only queried on a cache miss.
+   """
+   name = epicsvars[var]
+   if len(channel_cache) == 0:
+      load_channel_cache()
+   if name in channel_cache:
+      chan_id, host, nmya, tlookup = channel_cache[name]
+      if time.time() - tlookup < channel_cache_ttl:
+         return (chan_id, nmya)
+   query = "SELECT chan_id, host FROM channels WHERE name = " + paramstyle
    chan_id = -1
-   for (c, h) in cursor:
-      chan_id = c
-      host = h
+   with archive_connection(0) as mya0:
+      cursor = mya0.cursor()
+      try:
+         cursor.execute(query, (name,))
+         for (c, h) in cursor:
+            chan_id = c
+            host = h
+      finally:
+         cursor.close()
    if chan_id == -1:
-      print "update_epics_record error -",
-      print "epics variable", epicsvars[var], 
+      print "lookup_channel error -",
+      print "epics variable", name,
       print "is not in the archive, cannot continue!"
-      print cursor._executed
+      print query, name
       sys.exit(1)
-   cursor.close()
-
-   nmya = -1
-   for h in myahost:
-      if h["name"] == host + ".acc.jlab.org":
-         nmya = int(host[6])
-   if nmya < 0:
-      print "update_epics_record error -",
-      print "mya host", host, 
+
+   if not host in myaindex:
+      print "lookup_channel error -",
+      print "mya host", host,
       print "is not in my archive server list, cannot continue!"
       sys.exit(1)
+   nmya = myaindex[host]
+   channel_cache[name] = [chan_id, host, nmya, time.time()]
+   save_channel_cache()
+   return (chan_id, nmya)
+
+def lookup_channels(vars=None):
+   """
+   Resolve all of vars (default all of epicsvars) up front, so that
+   the interactive loops only ever hit the channel cache.
+   """
+   if vars is None:
+      vars = epicsvars.keys()
+   return dict((var, lookup_channel(var)) for var in vars)
+
+def query_rows(var, query):
+   chan_id, nmya = lookup_channel(var)
+   with archive_connection(nmya) as mya1:
+      cursor = mya1.cursor()
+      try:
+         cursor.execute(query.format(table="table_{0}".format(chan_id)))
+         return cursor.fetchall()
+      finally:
+         cursor.close()
+
+def query_chunks(var, query, chunksize=50000):
+   """
+   Generator over the result rows of query on the table of var, in
+   chunks of at most chunksize rows converted to (time, val) arrays.
+   The cursor is unbuffered, so the rows are streamed from the server
+   as they are consumed instead of being held all at once.
+   """
+   chan_id, nmya = lookup_channel(var)
+   with archive_connection(nmya) as mya1:
+      cursor = mya1.cursor()
+      try:
+         cursor.execute(query.format(table="table_{0}".format(chan_id)))
+         while True:
+            rows = cursor.fetchmany(chunksize)
+            if len(rows) == 0:
+               break
+            yield rows_to_arrays(rows)
+      finally:
+         cursor.close()
+
+def rows_to_arrays(rows):
+   times = numpy.array([r[0] for r in rows], dtype=numpy.int64)
+   vals = numpy.array([r[1] for r in rows])
+   return times, vals
+
+def collect_chunks(chunks, nmax):
+   """
+   Copy the (time, val) chunks from query_chunks into one pair of
+   arrays of at most nmax rows as they arrive, so that no more than
+   one chunk is held besides the output. The output starts at the
+   size of the first chunk and doubles as needed, up to nmax.
+   """
+   times = numpy.zeros(0, dtype=numpy.int64)
+   vals = numpy.zeros(0)
+   n = 0
+   for t, v in chunks:
+      m = min(len(t), nmax - n)
+      if n + m > len(times):
+         size = min(nmax, max(2 * len(times), n + m))
+         grown = numpy.empty(size, dtype=numpy.int64)
+         grown[:n] = times[:n]
+         times = grown
+         grown = numpy.empty(size, dtype=v.dtype if n == 0 else vals.dtype)
+         grown[:n] = vals[:n]
+         vals = grown
+      times[n:n + m] = t[:m]
+      vals[n:n + m] = v[:m]
+      n += m
+   return times[:n], vals[:n]
+
+def replica_store(var, times, vals, start, end=None):
+   """
+   Save the rows of var in the replica, marking [start, end) as complete;
+   end=None means that the rows are complete up to the present.
+   """
+   if use_replica:
+      if end is None:
+         end = int(time.time() * (1 << 28))
+      myareplica.store(epicsvars[var], times, vals, start, end)
 
+def fetch_range(var, start, end, nmax=1000000):
+   """
+   Query the rows of var with start <= time < end, at most nmax of
+   them, streaming them in chunks into time and val arrays. Returns
+   the arrays and the time up to which they are complete.
+   """
+   query = ("SELECT time, val1 FROM {table}" +
+            " WHERE time >= {0:d}".format(long(start)) +
+            " AND time < {0:d}".format(long(end)) +
+            " ORDER BY time ASC LIMIT {0}".format(nmax))
+   times, vals = collect_chunks(query_chunks(var, query), nmax)
+   if len(times) == nmax:
+      return times, vals, times[-1]
+   return times, vals, end
+
+def fetch_buckets(var, start, end, bucket):
+   """
+   Ask the archive for the min, max and mean of var in each interval
+   of bucket time units between start and end, and return the arrays
+   (tbucket, vmin, vmax, vmean) with tbucket the start of each bucket.
+   """
+   query = ("SELECT time - time % {0:d} AS tb,".format(long(bucket)) +
+            " MIN(val1), MAX(val1), AVG(val1) FROM {table}" +
+            " WHERE time >= {0:d}".format(long(start)) +
+            " AND time < {0:d}".format(long(end)) +
+            " GROUP BY tb ORDER BY tb ASC")
+   rows = query_rows(var, query)
+   if len(rows) == 0:
+      return [numpy.zeros(0)] * 4
+   cols = numpy.array(rows, dtype=float).T.copy()
+   return cols[0], cols[1], cols[2], cols[3]
+
+def print_epics_record(var, action):
+   times = epicsrecord[var]["time"]
+   print var, action, "from",
+   print datetime.datetime.fromtimestamp(times[0]/(1 << 28)).strftime('%d.%m.%Y %H:%M:%S'),
+   print "to",
+   print datetime.datetime.fromtimestamp(times[-1]/(1 << 28)).strftime('%d.%m.%Y %H:%M:%S'),
+   print ",", len(times), "elements"
+
+def update_epics_record(var, nmax=1000, stime=0):
+   """
+   Load a fresh window of up to nmax rows of var into epicsrecord,
+   starting nmax/2 rows before stime (or before the latest row if
+   stime is 0). epicsrecord[var] holds the time and val arrays of
+   the window in ascending time order.
+   """
    epicstime = stime * (1 << 28)
-   mya1 = mysql_connection(nmya)
-   cursor = mya1.cursor()
    if stime > 0:
-      query = ("SELECT time, val1 FROM table_{0}".format(chan_id) +
+      query = ("SELECT time, val1 FROM {table}" +
                " WHERE time < {0:f}".format(epicstime) +
                " ORDER BY time DESC LIMIT {0}".format(nmax/2))
    else:
-      query = ("SELECT time, val1 FROM table_{0}".format(chan_id) +
+      query = ("SELECT time, val1 FROM {table}" +
                " ORDER BY time DESC LIMIT {0}".format(nmax/2))
-   cursor.execute(query)
-   row = cursor.fetchall()
+   row = query_rows(var, query)
    if len(row) > 0:
       epicstime = row[-1][0]
-      query = ("SELECT time, val1 FROM table_{0}".format(chan_id) +
+      query = ("SELECT time, val1 FROM {table}" +
                " WHERE time >= {0:f}".format(epicstime) +
                " ORDER BY time ASC LIMIT {0}".format(nmax))
-      cursor.execute(query)
-      rows = cursor.fetchall()
-      epicsrecord[var] = rows[::-1]
-      print var, "updated from", 
-      print datetime.datetime.fromtimestamp(epicsrecord[var][-1][0]/(1 << 28)).strftime('%d.%m.%Y %H:%M:%S'),
-      print "to",
-      print datetime.datetime.fromtimestamp(epicsrecord[var][0][0]/(1 << 28)).strftime('%d.%m.%Y %H:%M:%S'),
-      print ",", len(epicsrecord[var]), "elements"
+      rows = query_rows(var, query)
+      times, vals = rows_to_arrays(rows)
+      if len(rows) == nmax:
+         replica_store(var, times, vals, times[0], times[-1])
+      else:
+         replica_store(var, times, vals, times[0])
+      epicsrecord[var] = {"time": times, "val": vals}
+      print_epics_record(var, "updated")
    else:
-      epicsrecord[var] = []
-   cursor.close()
+      epicsrecord[var] = {"time": numpy.zeros(0, dtype=numpy.int64),
+                          "val": numpy.zeros(0)}
+
+def extend_epics_record(var, nmax, forward):
+   """
+   Append the next nmax rows of var after the end of its window, or
+   prepend the nmax rows before its start if forward is False, then
+   trim the other end of the window to max_record_size rows. Returns
+   the number of rows added.
+   """
+   rec = epicsrecord[var]
+   if forward:
+      query = ("SELECT time, val1 FROM {table}" +
+               " WHERE time > {0:d}".format(long(rec["time"][-1])) +
+               " ORDER BY time ASC LIMIT {0}".format(nmax))
+   else:
+      query = ("SELECT time, val1 FROM {table}" +
+               " WHERE time < {0:d}".format(long(rec["time"][0])) +
+               " ORDER BY time DESC LIMIT {0}".format(nmax))
+   rows = query_rows(var, query)
+   times, vals = rows_to_arrays(rows)
+   full = (len(rows) == nmax)
+   if forward:
+      replica_store(var, times, vals, rec["time"][-1],
+                    times[-1] if full else None)
+   else:
+      replica_store(var, times, vals, times[-1] + 1 if full else 0,
+                    rec["time"][0])
+   if len(rows) == 0:
+      return 0
+   if forward:
+      rec["time"] = numpy.concatenate((rec["time"], times))[-max_record_size:]
+      rec["val"] = numpy.concatenate((rec["val"], vals))[-max_record_size:]
+   else:
+      rec["time"] = numpy.concatenate((times[::-1], rec["time"]))[:max_record_size]
+      rec["val"] = numpy.concatenate((vals[::-1], rec["val"]))[:max_record_size]
+   return len(rows)
 
 def get_epics_record(var, stime):
+   """
+   Return the last (time, val) row of var before stime. Times just
+   outside of the cached window are served by extending the window
+   with the missing rows, larger jumps reload it around stime.
+   """
    epicstime = stime * (1 << 28)
-   try:
-      if epicsrecord[var][0][0] < epicstime:
-         print "fast-forward", var
-         update_epics_record(var, 1000, stime)
-      elif epicsrecord[var][-1][0] > epicstime:
-         print "rewind", var
-         update_epics_record(var, 1000, stime)
-   except:
+   if use_replica:
+      rec = epicsrecord.get(var, {"time": []})
+      if len(rec["time"]) == 0 or not (rec["time"][0] < epicstime and
+                                       rec["time"][-1] >= epicstime):
+         row = myareplica.lookup(epicsvars[var], epicstime)
+         if row is not None:
+            return row
+   if not var in epicsrecord or len(epicsrecord[var]["time"]) == 0:
       update_epics_record(var, 1000, stime)
-   for row in epicsrecord[var]:
-      if epicstime > row[0]:
-         return row
+   rec = epicsrecord[var]
+   if len(rec["time"]) > 0 and rec["time"][-1] < epicstime:
+      if extend_epics_record(var, 1000, True) > 0:
+         if rec["time"][-1] < epicstime:
+            print "fast-forward", var
+            update_epics_record(var, 1000, stime)
+   elif len(rec["time"]) > 0 and rec["time"][0] >= epicstime:
+      if extend_epics_record(var, 1000, False) > 0:
+         if rec["time"][0] >= epicstime:
+            print "rewind", var
+            update_epics_record(var, 1000, stime)
+   rec = epicsrecord[var]
+   i = numpy.searchsorted(rec["time"], epicstime) - 1
+   if i >= 0:
+      return (rec["time"][i].item(), rec["val"][i].item())
    print "lookup of", var, "failed"
    return []
 
+def find_transition(var, stime, threshold, above=True, forward=True):
+   """
+   Return the first (time, val) row of var after stime whose value
+   is >= threshold (above=True) or <= threshold (above=False), or the
+   last such row before stime if forward is False, or [] if there is
+   none. The search is done by the archive server in a single query.
+   """
+   epicstime = stime * (1 << 28)
+   op = ">=" if above else "<="
+   if forward:
+      query = ("SELECT time, val1 FROM {table}" +
+               " WHERE time >= {0:f}".format(epicstime) +
+               " AND val1 {0} {1}".format(op, threshold) +
+               " ORDER BY time ASC LIMIT 1")
+   else:
+      query = ("SELECT time, val1 FROM {table}" +
+               " WHERE time < {0:f}".format(epicstime) +
+               " AND val1 {0} {1}".format(op, threshold) +
+               " ORDER BY time DESC LIMIT 1")
+   rows = query_rows(var, query)
+   if len(rows) > 0:
+      return rows[0]
+   return []
+
+def jump_to_transition(var, epoch, threshold, above=True, forward=True):
+   """
+   Step epoch by whole seconds to just after the next row of var
+   that crosses threshold, see find_transition, so that it is the
+   row returned by get_epics_record at the new epoch. Returns epoch
+   unchanged if var is already past threshold at epoch.
+   """
+   row = get_epics_record(var, epoch)
+   if len(row) > 0 and (row[1] >= threshold if above else
+                        row[1] <= threshold):
+      return epoch
+   row = find_transition(var, epoch, threshold, above, forward)
+   if len(row) == 0:
+      print "no transition of", var, "found",
+      print "after" if forward else "before", "epoch", epoch
+      return epoch
+   return epoch + numpy.floor(row[0] / float(1 << 28) - epoch) + 1
+
+def fetch_epics_records(vars, stime):
+   """
+   Look up the records of all of vars at time stime concurrently,
+   one thread per variable, with the queries to each archive server
+   spread over its connection pool. Returns a dict var -> row.
+   """
+   lookup_channels(vars)
+   nthreads = min(len(vars), pool_size * len(myahost))
+   if nthreads < 2:
+      return dict((var, get_epics_record(var, stime)) for var in vars)
+   threads = ThreadPool(nthreads)
+   try:
+      rows = threads.map(lambda var: get_epics_record(var, stime), vars)
+   finally:
+      threads.close()
+      threads.join()
+   return dict(zip(vars, rows))
+
 def follow():
+   lookup_channels()
    epoch = time.time()
    lastime = ""
    while True:
@@ -214,19 +630,15 @@ def follow():
       if len(newtime) == 0:
          pass
       elif newtime[0] == 'f': # fast-forward to the next FSD 
-         while True:
-            cur = get_epics_record("cur", epoch)
-            if cur[1] > 0:
-               epoch += 1
-            else:
-               break
+         epoch = jump_to_transition("cur", epoch, 0, above=False)
       elif newtime[0] == 'r': # fast-forward to the next beam-on period
-         while True:
-            cur = get_epics_record("cur", epoch)
-            if cur[1] < 10:
-               epoch += 1
-            else:
-               break
+         epoch = jump_to_transition("cur", epoch, 10, above=True)
+      elif newtime[0] == 'F': # rewind to the previous FSD
+         epoch = jump_to_transition("cur", epoch, 0, above=False,
+                                    forward=False)
+      elif newtime[0] == 'R': # rewind to the previous beam-on period
+         epoch = jump_to_transition("cur", epoch, 10, above=True,
+                                    forward=False)
       elif newtime[0] == '+':
          epoch += float(newtime)
       elif len(newtime) > 0 and newtime[0] == '-':
@@ -236,10 +648,8 @@ def follow():
             epoch = int(time.mktime(time.strptime(newtime, pattern)))
          except:
             return
-      record = {}
-      for var in epicsvars:
-         record[var] = get_epics_record(var, epoch)
-      g = gains[record['gain'][1]]
+      record = fetch_epics_records(list(epicsvars), epoch)
+      g = gains[int(record['gain'][1])]
       for var in ("ixp", "ixm", "iyp", "iym", "oxp", "oxm", "oyp", "oym"):
          if var + "_ped" in record and len(record[var + '_ped']) > 0:
             ped = record[var + '_ped'][1] * gpedestal[g][var]
@@ -257,41 +667,158 @@ def follow():
       print timestring,
       print "gain: {0:.0e}".format(g),
       for var in ("ix", "iy", "ox", "oy"):
-         if var + 'p_ped' in record and len(record[var + 'p_ped']) > 0:
-            Ip_ped = record[var + 'p_ped'][1] * gpedestal[g][var + 'p']
-            Im_ped = record[var + 'm_ped'][1] * gpedestal[g][var + 'm']
-         else:
-            Ip_ped = pedestals[g][var + 'p']
-            Im_ped = pedestals[g][var + 'm']
-         Ip = record[var + 'p'][1] - Ip_ped
-         Im = record[var + 'm'][1] - Im_ped
-         """ Old calibration, disabled
-         P = calparamP[g][var]
-         Q = calparamQ[g][var]
-         R = calparamR[g][var]
-         S = calparamS[g][var]
-         x = S * (Ip - R * Im + P) / (Ip + R * Im + Q + 1e-99)
-         """
-         A = Ip * calparamE[g][var + 'm'] - Im * calparamE[g][var + 'p']
-         B = Ip * calparamF[g][var + 'm'] - Im * calparamF[g][var + 'p']
-         C = Ip * calparamG[g][var + 'm'] - Im * calparamG[g][var + 'p']
-         D = B**2 - 4 * A * C
-         if D > 0 and Ip + Im > 100:
-            x = (-B - D**0.5) / (2 * A) 
-         else:
+         x = wedge_position(record, g, var)
+         if x is None:
             x = "***"
          print var, ":", x, "   ",
       print "xmo:", record['xmo'][1], "ymo:", record['ymo'][1]
    
       # keep track of my own pedestals, the EPICS values are not consistent
       if current == 0:
-         f = 0.5
-         for var in ("ixp", "ixm", "iyp", "iym", "oxp", "oxm", "oyp", "oym"):
-            pedestals[g][var] = pedestals[g][var] * (1-f) + record[var][1] * f
+         update_pedestals(record, g)
 
    #close_mysql_connections()
 
-def plot(vars=["ixp", "iyp", "oxp", "oyp", "cur", "bpu"], start=0, duration=0):
+def wedge_position(record, g, var):
+   """
+   Reconstruct the beam position along var (one of "ix", "iy", "ox",
+   "oy") from the pedestal-subtracted currents of its p and m wedges
+   in record, using the E/F/G quadratic calibration for gain g that
+   is valid at the time of the record in the accal store. Returns None
+   if there is no solution or too little signal.
+   """
+   cal = accal.lookup(record[var + 'p'][0] / (1 << 28), g)
+   if cal is None:
+      return None
+   p = accal.index[var + 'p']
+   m = accal.index[var + 'm']
+   if var + 'p_ped' in record and len(record[var + 'p_ped']) > 0:
+      Ip_ped = record[var + 'p_ped'][1] * cal["gped"][p]
+      Im_ped = record[var + 'm_ped'][1] * cal["gped"][m]
+   else:
+      # my own running pedestals, see update_pedestals
+      Ip_ped = pedestals[g][var + 'p']
+      Im_ped = pedestals[g][var + 'm']
+   Ip = record[var + 'p'][1] - Ip_ped
+   Im = record[var + 'm'][1] - Im_ped
+   """ Old calibration, disabled
+   P = cal["P"][accal.index[var]]
+   Q = cal["Q"][accal.index[var]]
+   R = cal["R"][accal.index[var]]
+   S = cal["S"][accal.index[var]]
+   x = S * (Ip - R * Im + P) / (Ip + R * Im + Q + 1e-99)
+   """
+   x, valid = acpos.solve(Ip, Im, cal["E"][p], cal["E"][m],
+                          cal["F"][p], cal["F"][m], cal["G"][p], cal["G"][m],
+                          min_signal=100)
+   if valid:
+      return float(x)
+   return None
+
+def update_pedestals(record, g, f=0.5):
+   for var in ("ixp", "ixm", "iyp", "iym", "oxp", "oxm", "oyp", "oym"):
+      pedestals[g][var] = pedestals[g][var] * (1-f) + record[var][1] * f
+
+def poll_rows(var, watermark, nmax=10000):
+   """
+   Return the time and val arrays of the rows of var newer than
+   watermark, at most nmax of them.
+   """
+   query = ("SELECT time, val1 FROM {table}" +
+            " WHERE time > {0:d}".format(long(watermark)) +
+            " ORDER BY time ASC LIMIT {0}".format(nmax))
+   return collect_chunks(query_chunks(var, query), nmax)
+
+def monitor(interval=2, window=600, npolls=0, display=True):
+   """
+   Follow the archive as it is being written. Every interval seconds
+   the rows of each channel newer than its watermark are fetched
+   concurrently, the pedestals and the wedge positions are updated
+   from the latest values, and a chart of the last window seconds of
+   positions is redrawn. Only the latest row of each channel and the
+   fixed-length chart history are kept, so it can run indefinitely.
+   Stops after npolls polls, or never if npolls is 0, or on ctrl-c.
+   Returns the chart history.
+   """
+   lookup_channels()
+   vars = list(epicsvars)
+   record = {}
+   watermark = {}
+   for var in vars:
+      rows = query_rows(var, "SELECT time, val1 FROM {table}" +
+                             " ORDER BY time DESC LIMIT 1")
+      record[var] = tuple(rows[0]) if len(rows) > 0 else ()
+      watermark[var] = rows[0][0] if len(rows) > 0 else 0
+   npoints = int(window / interval) + 1
+   history = {}
+   for key in ("t", "cur", "ix", "iy", "ox", "oy"):
+      history[key] = collections.deque(maxlen=npoints)
+   threads = ThreadPool(min(len(vars), pool_size * len(myahost)))
+   npoll = 0
+   try:
+      while npolls == 0 or npoll < npolls:
+         tpoll = time.time()
+         rows = threads.map(lambda var: poll_rows(var, watermark[var]), vars)
+         for var, (times, vals) in zip(vars, rows):
+            if len(times) > 0:
+               watermark[var] = times[-1]
+               record[var] = (times[-1].item(), vals[-1].item())
+         npoll += 1
+         if min(len(record[var]) for var in vars) > 0:
+            g = gains[int(record['gain'][1])]
+            current = record['cur'][1]
+            if current == 0:
+               update_pedestals(record, g)
+            history["t"].append(max(watermark.values()) / float(1 << 28))
+            history["cur"].append(current)
+            for var in ("ix", "iy", "ox", "oy"):
+               x = wedge_position(record, g, var)
+               history[var].append(numpy.nan if x is None else x)
+            if display:
+               draw_monitor(history, window)
+         time.sleep(max(0, interval - (time.time() - tpoll)))
+   except KeyboardInterrupt:
+      pass
+   finally:
+      threads.close()
+      threads.join()
+   return history
+
+def draw_monitor(history, window):
+   global mgraph
+   c1 = gROOT.FindObject("c1")
+   if not c1:
+      c1 = TCanvas("c1", "active collimator monitor", 800, 500)
+   c1.cd()
+   tnow = history["t"][-1]
+   t = numpy.array(history["t"]) - tnow
+   mgraph = TMultiGraph("mgraph", "wedge positions over the last " +
+                        "{0} s;time (s);position".format(window))
+   color = 1
+   for var in ("ix", "iy", "ox", "oy"):
+      x = numpy.array(history[var], dtype=float)
+      good = numpy.isfinite(x)
+      if numpy.count_nonzero(good) > 0:
+         gr = TGraph(int(numpy.count_nonzero(good)), t[good].copy(),
+                                                     x[good].copy())
+         gr.SetTitle(var)
+         gr.SetLineColor(color)
+         mgraph.Add(gr, "l")
+      color += 1
+   if mgraph.GetListOfGraphs():
+      mgraph.Draw("a")
+      mgraph.GetXaxis().SetLimits(-window, 0)
+   c1.Update()
+
+def plot(vars=["ixp", "iyp", "oxp", "oyp", "cur", "bpu"], start=0, duration=0,
+         width=0):
+   """
+   Draw the archive history of vars over duration seconds from start.
+   Periods longer than width (default plot_width) times
+   aggregate_min_bucket seconds are drawn from per-bucket min, max and
+   mean values computed by the archive server, one bucket per pixel,
+   as a min/max band around the mean; shorter ones from the raw rows.
+   """
    pattern = '%d.%m.%Y %H:%M:%S'
    if start == 0:
       start = raw_input("Enter the start date and time [dd.mm.yyyy hh:mm:ss]: ")
@@ -299,62 +826,48 @@ def plot(vars=["ixp", "iyp", "oxp", "oyp", "cur", "bpu"], start=0, duration=0):
    if duration == 0:
       duration = raw_input("Enter the length of the period to plot [seconds]: ")
       duration = int(duration)
+   if width == 0:
+      width = plot_width
+   bucket = duration / float(width)
+   lookup_channels(vars)
    global graphs
+   global envelopes
    graphs = {}
+   envelopes = {}
    vlimits = [0] * 2
    for var in vars:
-      mya0 = mysql_connection(0)
-      cursor = mya0.cursor()
-      query = "SELECT chan_id, host FROM channels WHERE name = %s"
-      cursor.execute(query, (epicsvars[var],))
-      chan_id = -1
-      for (c, h) in cursor:
-         chan_id = c
-         host = h
-      if chan_id == -1:
-         print "update_epics_record error -",
-         print "epics variable", epicsvars[var], 
-         print "is not in the archive, cannot continue!"
-         print cursor._executed
-         sys.exit(1)
-      cursor.close()
-      nmya = -1
-      for h in myahost:
-         if h["name"] == host + ".acc.jlab.org":
-            nmya = int(host[6])
-      if nmya < 0:
-         print "update_epics_record error -",
-         print "mya host", host, 
-         print "is not in my archive server list, cannot continue!"
-         sys.exit(1)
-
+      chan_id, nmya = lookup_channel(var)
       epicstime = [epoch * (1 << 28), (epoch + duration) * (1 << 28)]
-      mya1 = mysql_connection(nmya)
-      cursor = mya1.cursor()
-      query = ("SELECT time, val1 FROM table_{0}".format(chan_id) +
-               " WHERE time >= {0:f}".format(epicstime[0]) +
-               " AND time <= {0:f}".format(epicstime[1]) +
-               " ORDER BY time ASC LIMIT {0}".format(1000000))
       print "nmya is", nmya
       print "epoch of start:", epoch
       print "epoch of stop:", epoch + duration
-      print "query is SELECT time, val1 FROM table_{0}".format(chan_id) +\
-               " WHERE time >= {0:f}".format(epicstime[0]) +\
-               " AND time <= {0:f}".format(epicstime[1]) +\
-               " ORDER BY time ASC LIMIT {0}".format(1000000)
-      cursor.execute(query)
-      rows = cursor.fetchall()
-      print var, "has", len(rows), "rows"
-      ti = []
-      va = []
-      for (t, v) in rows:
-         vlimits[0] = v if v < vlimits[0] else vlimits[0]
-         vlimits[1] = v if v > vlimits[1] else vlimits[1]
-         ti.append(t / (1 << 28) - epoch)
-         va.append(v)
-      if len(ti) > 0:
-         graphs[var] = TGraph(len(ti), numpy.array(ti, dtype=float), 
-                                       numpy.array(va, dtype=float))
+      if bucket > aggregate_min_bucket:
+         tb, vmin, vmax, vmean = fetch_buckets(var, epicstime[0],
+                                               epicstime[1] + 1,
+                                               bucket * (1 << 28))
+         print var, "has", len(tb), "buckets of", bucket, "s"
+         if len(tb) > 0:
+            vlimits[0] = min(vlimits[0], vmin.min())
+            vlimits[1] = max(vlimits[1], vmax.max())
+            ti = (tb / (1 << 28)) + bucket / 2 - epoch
+            graphs[var] = TGraph(len(ti), ti, vmean)
+            band = numpy.concatenate((vmax, vmin[::-1]))
+            tband = numpy.concatenate((ti, ti[::-1]))
+            envelopes[var] = TGraph(len(tband), tband, band)
+         continue
+      fetcher = lambda t0, t1: fetch_range(var, t0, t1)
+      if use_replica:
+         times, vals = myareplica.fetch(epicsvars[var], epicstime[0],
+                                        epicstime[1] + 1, fetcher)
+      else:
+         times, vals, tdone = fetcher(epicstime[0], epicstime[1] + 1)
+      print var, "has", len(times), "rows"
+      if len(times) > 0:
+         vlimits[0] = min(vlimits[0], vals.min())
+         vlimits[1] = max(vlimits[1], vals.max())
+         ti = times / float(1 << 28) - epoch
+         graphs[var] = TGraph(len(ti), numpy.array(ti, dtype=float),
+                                       numpy.array(vals, dtype=float))
    global hframe
    hframe = TH1D("hframe", "time chart", 1, 0, duration)
    hframe.GetXaxis().SetTitle("time (s) starting {0}".format(start))
@@ -365,6 +878,11 @@ def plot(vars=["ixp", "iyp", "oxp", "oyp", "cur", "bpu"], start=0, duration=0):
    color = 1
    for var in graphs:
       print "graphing", var
+      if var in envelopes:
+         envelopes[var].SetFillColor(color)
+         envelopes[var].SetFillStyle(3001)
+         envelopes[var].SetLineColor(color)
+         envelopes[var].Draw("f")
       graphs[var].SetLineColor(color)
       graphs[var].Draw("l")
       color += 1
@@ -4,71 +4,256 @@
 #               and write out the scan data as a root tree.
 #
 # author: richard.t.jones at uconn.edu
-# version: march 31, 2018 [rtj]
+# version: october 18, 2026 [rtj]
 #
 # usage:
-#          $ mda2root.py <inputfile.mda>
+#          $ mda2root.py [-o <outdir>] [-j <jobs>] [-f] [-d <spec>] <inputs> ...
+#
+# where the inputs are mda files, directories holding mda files, or
+# glob patterns like "data/collimXY_scan_*.mda".
 #
 # notes:
-# 1) Before invoking mda2root.py, make sure that you have the mda2ascii
-#    utility in your path. This is part of the mdautils package written
-#    by Dohn Arms (Argonne).
+# 1) The mda file is decoded directly from its XDR encoding, as laid
+#    out by the saveData/mdautils packages (Argonne). No mda2ascii
+#    utility or intermediate text files are needed any more.
+# 2) The output tree has one entry per point of each 1-D (innermost)
+#    scan in the file, in the order mda2ascii used to write them out,
+#    with the positioner and detector values of the point as columns.
+#    The example of the former mda2ascii output below shows the column
+#    names and their order. Each column is a separate branch, double
+#    for the positioners, int for the detectors in units of counts and
+#    float for all other detectors, after an int entry branch.
+# 3) The output of each input is <basename>.root in the output
+#    directory, which also holds the manifest mda2root_manifest.json of
+#    all of the conversions made there, which is created if needed.
+#    An input is converted again only if its output is missing, its
+#    size or mtime changed since and its content too, or the output
+#    was made by an older converter_version or with another derived
+#    column spec. Inputs must have distinct file names.
+# 4) With -d <spec>, derived columns defined in the spec file as
+#    arithmetic on the other columns (see load_derived) are computed
+#    during the conversion and written as double branches of their
+#    own. See scans_derived.txt for the sums and current-normalized
+#    columns used by scans.py.
 
 from ROOT import *
 import numpy
-import subprocess
+import xdrlib
+import multiprocessing
+import argparse
+import hashlib
+import glob
+import json
+import time
 import sys
 import os
 import re
 
-varname = []
+# change converter_version whenever the output of the conversion
+# changes, so that batch runs convert all of their inputs again
+converter_version = "3.0"
+manifest_name = "mda2root_manifest.json"
 
-def usage():
-   print "Usage: mda2root.py <inputfile.mda>"
-   print " You must have mda2ascii in your PATH before invoking this command."
-   sys.exit(1)
+leaf_dtype = {"D": numpy.float64, "F": numpy.float32, "I": numpy.int32}
 
-def declare_theTree():
-   global tree
-   global varray
-   if not tree:
-      tree = TTree("theTree", "EPICS scan data")
-      varray = numpy.array([0] * len(varname), dtype=float)
-      form = "/D:".join(varname) + "/D"
-      tree.Branch("scan_data", varray, form)
-   return tree
-   
-def fill_theTree(asc):
-   global varray
-   if len(varname) == 0:
-      varname.append("entry")
-   for line in asc:
-      if re.match(r"^[1-9]", line):
-         tree = declare_theTree()
-         f = line.split()
-         for i in range(1, len(f)):
-            varray[i] = float(f[i])
-         varray[0] += 1
-         tree.Fill()
-      elif line[0] == '#':
-         try:
-            vnum = int(re.search(r"^#  *([1-9][0-9]*)  *\[1-D (Detector|Positioner)  *([0-9]*)", line).group(1))
-            vname = re.search(r"] *([^,]*),", line).group(1)
-            vname = re.sub(r":", "_", vname)
-            vname = re.sub(r"\.", "_", vname)
-         except:
-            continue
-         if vnum == 1:
-            continue
-         elif vnum == len(varname) + 1:
+def unpack_text(u):
+   """
+   Unpack an mda string, an int flag followed by an XDR string if
+   the flag is nonzero.
+   """
+   if u.unpack_int():
+      return u.unpack_string()
+   return ""
+
+def unpack_array(u, n, dtype):
+   """
+   Unpack a fixed-length XDR array of n values straight into a numpy
+   array of big-endian dtype.
+   """
+   pos = u.get_position()
+   data = numpy.frombuffer(u.get_buffer(), dtype=dtype, count=n, offset=pos)
+   u.set_position(pos + data.nbytes)
+   return data
+
+def read_scan(u, offset):
+   """
+   Decode the scan at byte offset, and generate the 1-D scans within
+   it as dicts with the positioner and detector names, the leaf type
+   of each column (see leaf_type), and the columns of values at each
+   of its points, one array per name.
+   """
+   u.set_position(offset)
+   rank = u.unpack_int()
+   npts = u.unpack_int()
+   cpt = u.unpack_int()
+   if rank > 1:
+      offsets = unpack_array(u, npts, ">i4")
+      for suboffset in offsets[:cpt]:
+         if suboffset > 0:
+            for scan in read_scan(u, int(suboffset)):
+               yield scan
+      return
+   name = unpack_text(u)
+   tstamp = unpack_text(u)
+   npos = u.unpack_int()
+   ndet = u.unpack_int()
+   ntrg = u.unpack_int()
+   names = []
+   leaves = []
+   for i in range(0, npos):
+      u.unpack_int()
+      names.append(unpack_text(u))
+      leaves.append("D")
+      for field in range(0, 6):
+         unpack_text(u) # description, step mode, units, readback...
+   for i in range(0, ndet):
+      u.unpack_int()
+      names.append(unpack_text(u))
+      unpack_text(u) # description
+      leaves.append(leaf_type(unpack_text(u)))
+   for i in range(0, ntrg):
+      u.unpack_int()
+      unpack_text(u)
+      u.unpack_float()
+   columns = []
+   for i in range(0, npos):
+      columns.append(unpack_array(u, npts, ">f8")[:cpt])
+   for i in range(0, ndet):
+      columns.append(unpack_array(u, npts, ">f4")[:cpt])
+   yield {"name": name, "time": tstamp, "names": names, "leaves": leaves,
+          "columns": columns}
+
+def read_mda(mdafile):
+   """
+   Generate the 1-D scans in mdafile, see read_scan.
+   """
+   u = xdrlib.Unpacker(open(mdafile, "rb").read())
+   version = u.unpack_float()
+   number = u.unpack_int()
+   rank = u.unpack_int()
+   dims = unpack_array(u, rank, ">i4")
+   regular = u.unpack_int()
+   extra = u.unpack_int()
+   for scan in read_scan(u, u.get_position()):
+      yield scan
+
+def leaf_type(units):
+   """
+   Return the leaf type of a detector with the given units, I for the
+   ADC counts, F for the readbacks of everything else.
+   """
+   if units.strip() == "counts":
+      return "I"
+   return "F"
+
+def load_derived(specfile):
+   """
+   Read a derived column spec, with lines of the form
+      name = expression
+   where expression is arithmetic in the names of the columns of the
+   tree and of the derived columns defined above it, and return the
+   list of (name, expression, compiled expression).
+   """
+   derived = []
+   for line in open(specfile):
+      line = line.split("#")[0].strip()
+      if len(line) == 0:
+         continue
+      spec = re.match(r"([A-Za-z_][A-Za-z0-9_]*) *= *(.+)$", line)
+      if not spec:
+         raise ValueError("bad derived column spec: " + line)
+      name, expr = spec.group(1), spec.group(2).strip()
+      derived.append((name, expr, compile(expr, specfile, "eval")))
+   return derived
+
+def eval_derived(table, derived):
+   """
+   Evaluate the derived columns on the columns of table, and store
+   them in its fields of the same names.
+   """
+   columns = dict((name, table[name].astype(numpy.float64))
+                  for name in table.dtype.names)
+   for name, expr, code in derived:
+      try:
+         with numpy.errstate(divide="ignore", invalid="ignore"):
+            value = eval(code, {"__builtins__": {}}, columns)
+      except NameError, e:
+         raise ValueError("derived column {0}: {1}".format(name, e))
+      # division by zero gives 0, as in TTree::Draw expressions
+      value = numpy.zeros(len(table)) + value
+      value[~numpy.isfinite(value)] = 0
+      columns[name] = value
+      table[name] = value
+
+def write_theTree(scans, derived=[]):
+   """
+   Write the columns of all of the 1-D scans as separate branches of
+   theTree, with an entry branch counting the points from 1, followed
+   by the double branches of the derived columns (see load_derived)
+   that can be computed from the columns present, and return the tree.
+   """
+   varname = ["entry"]
+   leaves = ["I"]
+   for scan in scans:
+      for vnum in range(0, len(scan["names"])):
+         vname = re.sub(r"[:.]", "_", scan["names"][vnum])
+         if vnum == len(varname) - 1:
+            if vname in varname:
+               vname += "_{0}".format(vnum + 2)
             varname.append(vname)
-         elif varname[vnum - 1] == vname:
-            continue
-         else:
-            print "Error - variable", vnum, "(", vname, ") delared out of order,"
-            print "vnum, len(varname) = ", vnum, len(varname)
-            print "cannot continue."
-            sys.exit(1)
+            leaves.append(scan["leaves"][vnum])
+         elif varname[vnum + 1] != vname and \
+              varname[vnum + 1] != vname + "_{0}".format(vnum + 2):
+            raise ValueError("variable {0} ({1}) declared out of order"
+                             .format(vnum + 2, vname))
+   if len(scans) == 0:
+      return 0
+   present = []
+   for name, expr, code in derived:
+      if name in varname:
+         raise ValueError("derived column {0} already exists".format(name))
+      missing = [n for n in code.co_names if not n in varname]
+      if missing:
+         print "mda2root warning - derived column", name,
+         print "skipped, no column", missing[0]
+         continue
+      present.append((name, expr, code))
+      varname.append(name)
+      leaves.append("D")
+
+   # gather the columns of all scans into one contiguous table
+   record = numpy.dtype([(varname[n], leaf_dtype[leaves[n]])
+                         for n in range(0, len(varname))], align=True)
+   nentries = sum(len(scan["columns"][0]) for scan in scans
+                  if len(scan["columns"]) > 0)
+   table = numpy.zeros(nentries, dtype=record)
+   table["entry"] = numpy.arange(1, nentries + 1)
+   row = 0
+   for scan in scans:
+      if len(scan["columns"]) == 0:
+         continue
+      part = slice(row, row + len(scan["columns"][0]))
+      for vnum in range(0, len(scan["columns"])):
+         column = scan["columns"][vnum]
+         if leaves[vnum + 1] == "I":
+            column = numpy.rint(column)
+         table[varname[vnum + 1]][part] = column
+      row = part.stop
+   eval_derived(table, present)
+
+   # one branch per column, reading from the fields of a record buffer
+   tree = TTree("theTree", "EPICS scan data")
+   buf = numpy.zeros(record.itemsize, dtype=numpy.uint8)
+   for n in range(0, len(varname)):
+      offset = record.fields[varname[n]][1]
+      size = record.fields[varname[n]][0].itemsize
+      tree.Branch(varname[n], buf[offset:offset + size].view(
+                  leaf_dtype[leaves[n]]), varname[n] + "/" + leaves[n])
+   rows = table.view(numpy.uint8).reshape(nentries, record.itemsize)
+   for i in range(0, nentries):
+      buf[:] = rows[i]
+      tree.Fill()
+   return tree
 
 # Column Descriptions:
 #    1  [     Index      ]
@@ -446,37 +631,173 @@ def fill_theTree(asc):
 *............................................................................*
 """
 
-if len(sys.argv) != 2:
-   usage()
+def convert(mdafile, outdir=".", derived=[]):
+   """
+   Convert mdafile to <basename>.root in outdir, adding the derived
+   columns from load_derived, and return the name of the output file
+   and the number of tree entries written.
+   """
+   basename = re.search(r"([^/][^/]*)\.mda", mdafile)
+   if not basename:
+      raise ValueError("input file name does not end in .mda")
+   rootfile = os.path.join(outdir, basename.group(1) + ".root")
+   scans = list(read_mda(mdafile))
+   fout = TFile(rootfile, "recreate")
+   try:
+      tree = write_theTree(scans, derived)
+      if not tree or tree.GetEntries() == 0:
+         raise ValueError("no scan data found")
+   except ValueError:
+      fout.Close()
+      os.remove(rootfile)
+      raise
+   tree.Write()
+   entries = tree.GetEntries()
+   fout.Close()
+   return rootfile, entries
+
+def file_digest(path):
+   sha1 = hashlib.sha1()
+   with open(path, "rb") as f:
+      for block in iter(lambda: f.read(1 << 20), b""):
+         sha1.update(block)
+   return sha1.hexdigest()
+
+def convert_job(job):
+   """
+   Convert one input file for a batch, unless the manifest entry made
+   by this converter_version with the same derived column spec shows
+   that its output is still good, ie. the input has the same size and
+   mtime, or failing that the same content, as when it was converted.
+   The input is only hashed when its size or mtime has changed.
+   Returns (mdafile, manifest entry or None, message).
+   """
+   mdafile, outdir, entry, force, specfile, specdigest = job
+   stat = os.stat(mdafile)
+   digest = None
+   if entry and not force and \
+      entry.get("converter_version") == converter_version and \
+      entry.get("derived") == specdigest and \
+      os.path.exists(entry["output"]):
+      if entry.get("size") == stat.st_size and \
+         entry.get("mtime") == stat.st_mtime:
+         return mdafile, None, "up to date"
+      digest = file_digest(mdafile)
+      if entry.get("sha1") == digest:
+         entry = dict(entry, input=os.path.abspath(mdafile),
+                      size=stat.st_size, mtime=stat.st_mtime)
+         return mdafile, entry, "unchanged"
+   if digest is None:
+      digest = file_digest(mdafile)
+   try:
+      derived = load_derived(specfile) if specfile else []
+      rootfile, entries = convert(mdafile, outdir, derived)
+   except EOFError:
+      return mdafile, None, "error - truncated mda file"
+   except (IOError, ValueError), e:
+      return mdafile, None, "error - " + str(e)
+   entry = {"input": os.path.abspath(mdafile),
+            "output": os.path.abspath(rootfile),
+            "sha1": digest,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "entries": entries,
+            "converter_version": converter_version,
+            "derived": specdigest,
+            "converted": time.strftime("%Y-%m-%d %H:%M:%S"),
+           }
+   return mdafile, entry, "converted, {0} entries".format(entries)
+
+def find_inputs(args):
+   """
+   Expand the directories and glob patterns in args into a sorted
+   list of .mda files.
+   """
+   inputs = []
+   for arg in args:
+      if os.path.isdir(arg):
+         inputs += glob.glob(os.path.join(arg, "*.mda"))
+      elif os.path.exists(arg):
+         inputs.append(arg)
+      else:
+         inputs += glob.glob(arg)
+   return sorted(set(inputs))
 
-try:
-   res = subprocess.call(["mda2ascii", sys.argv[1]])
-   if res != 0:
-      usage()
-except:
-   usage()
+def load_manifest(manifest):
+   try:
+      return json.load(open(manifest))
+   except (IOError, ValueError):
+      return {}
 
-basename = re.search(r"([^/][^/]*).mda", sys.argv[1]).group(1)
-if len(basename) == 0:
-   usage()
-fout = TFile(basename + ".root", "recreate")
+def save_manifest(manifest, entries):
+   with open(manifest + ".tmp", "w") as f:
+      json.dump(entries, f, indent=1, sort_keys=True)
+   os.rename(manifest + ".tmp", manifest)
 
-tree = 0
-entry = numpy.array([0], dtype=float)
-for scan in range(0, 9999999):
+def main():
+   parser = argparse.ArgumentParser(description="convert EPICS scan " +
+                                    "data files in mda format to root trees")
+   parser.add_argument("inputs", nargs="+",
+                       help="mda files, directories of them, or globs")
+   parser.add_argument("-o", "--outdir", default=".",
+                       help="directory for the output root files")
+   parser.add_argument("-j", "--jobs", type=int, default=1,
+                       help="number of files converted in parallel, " +
+                            "0 for one per cpu")
+   parser.add_argument("-f", "--force", action="store_true",
+                       help="convert even the files that are up to date")
+   parser.add_argument("-d", "--derived", default=None,
+                       help="derived column spec, eg. scans_derived.txt")
+   args = parser.parse_args()
+
+   inputs = find_inputs(args.inputs)
+   if len(inputs) == 0:
+      print "mda2root error - no input files found"
+      sys.exit(1)
+   names = [os.path.basename(mdafile) for mdafile in inputs]
+   if len(set(names)) < len(names):
+      print "mda2root error - two input files have the same file name,",
+      print "cannot continue!"
+      sys.exit(1)
+   specdigest = None
+   if args.derived:
+      try:
+         load_derived(args.derived)
+         specdigest = file_digest(args.derived)
+      except (IOError, ValueError, SyntaxError), e:
+         print "mda2root error - cannot use derived column spec", e
+         sys.exit(1)
+   if not os.path.isdir(args.outdir):
+      os.makedirs(args.outdir)
+   manifest = os.path.join(args.outdir, manifest_name)
+   entries = load_manifest(manifest)
+   jobs = [(mdafile, args.outdir, entries.get(os.path.basename(mdafile)),
+            args.force, args.derived, specdigest) for mdafile in inputs]
+   pool = None
+   if args.jobs == 1 or len(jobs) == 1:
+      results = map(convert_job, jobs)
+   else:
+      pool = multiprocessing.Pool(args.jobs or None)
+      results = pool.imap_unordered(convert_job, jobs)
+   errors = 0
    try:
-      asc = open("{0}_{1:02d}.asc".format(basename, scan + 1))
+      for mdafile, entry, message in results:
+         print mdafile, ":", message
+         if entry:
+            entries[os.path.basename(mdafile)] = entry
+         elif message.startswith("error"):
+            errors += 1
    except:
-      nscans = scan
-      break
-   fill_theTree(asc)
-if tree:
-   tree.Write()
-else:
-   print "expected output from mda2ascii not found, quitting"
-   sys.exit(1)
+      if pool:
+         pool.terminate()
+      raise
+   finally:
+      if pool:
+         pool.close()
+         pool.join()
+      save_manifest(manifest, entries)
+   if errors:
+      sys.exit(1)
 
-# clean up and exit
-for scan in range(0, nscans):
-   os.remove("{0}_{1:02d}.asc".format(basename, scan + 1))
-sys.exit(0)
+if __name__ == "__main__":
+   main()
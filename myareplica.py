@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#
+# myareplica.py - local on-disk replica of the mya archive tables
+#                 read by live.py, so that time ranges that have been
+#                 fetched once are served from local disk afterwards.
+#
+# author: richard.t.jones at uconn.edu
+# version: october 18, 2026
+#
+# notes:
+# 1) The replica is one sqlite database replica.db in replica_dir,
+#    holding the rows fetched so far in a rows (chan, time, val) table
+#    indexed by channel and time, and for each channel the [start, end)
+#    time intervals within which all of the archive rows are present
+#    in a cover (chan, tstart, tend) table. Newly fetched ranges are
+#    merged into the cover, so that only the parts of a request that
+#    are not yet covered go back to the archive. Each store is one
+#    transaction that only inserts the new rows, so the replica stays
+#    consistent if the process dies part way, and nothing of it is
+#    kept in memory between calls.
+# 2) Times are in mya units, seconds * (1 << 28). Nothing later than
+#    now - settle_time is marked as covered, since the archive may
+#    still be receiving rows for that period.
+# 3) The total size of the replica is kept below max_bytes by deleting
+#    the channels that were used the longest time ago. The space they
+#    held is reused by later stores.
+
+import numpy
+import sqlite3
+import threading
+import time
+import os
+
+replica_dir = os.path.expanduser("~/.myareplica")
+max_bytes = 2 << 30
+settle_time = 300 # seconds
+
+db = None
+db_file = None
+lock = threading.RLock()
+
+def connect():
+   """
+   Return the connection to the replica database in replica_dir,
+   opening it and creating its tables on first use.
+   """
+   global db, db_file
+   dbfile = os.path.join(replica_dir, "replica.db")
+   if db is not None and db_file == dbfile:
+      return db
+   close()
+   if not os.path.isdir(replica_dir):
+      os.makedirs(replica_dir)
+   db = sqlite3.connect(dbfile, check_same_thread=False)
+   db_file = dbfile
+   with db:
+      db.execute("CREATE TABLE IF NOT EXISTS rows (chan TEXT," +
+                 " time INTEGER, val REAL, PRIMARY KEY (chan, time))" +
+                 " WITHOUT ROWID")
+      db.execute("CREATE TABLE IF NOT EXISTS cover (chan TEXT," +
+                 " tstart INTEGER, tend INTEGER)")
+      db.execute("CREATE INDEX IF NOT EXISTS cover_chan ON cover (chan)")
+      db.execute("CREATE TABLE IF NOT EXISTS used (chan TEXT PRIMARY KEY," +
+                 " tused REAL)")
+   return db
+
+def close():
+   global db, db_file
+   with lock:
+      if db is not None:
+         db.close()
+      db = None
+      db_file = None
+
+def load_cover(name):
+   rows = connect().execute("SELECT tstart, tend FROM cover" +
+                            " WHERE chan = ? ORDER BY tstart", (name,))
+   return [list(r) for r in rows]
+
+def touch_channel(name):
+   with connect() as c:
+      c.execute("INSERT OR REPLACE INTO used VALUES (?, ?)",
+                (name, time.time()))
+
+def replica_size():
+   c = connect()
+   pages = c.execute("PRAGMA page_count").fetchone()[0]
+   free = c.execute("PRAGMA freelist_count").fetchone()[0]
+   pagesize = c.execute("PRAGMA page_size").fetchone()[0]
+   return (pages - free) * pagesize
+
+def evict():
+   """
+   Delete the least recently used channels until the replica fits
+   within max_bytes, keeping at least the latest one.
+   """
+   c = connect()
+   while replica_size() > max_bytes:
+      names = [r[0] for r in c.execute("SELECT chan FROM used" +
+                                       " ORDER BY tused ASC LIMIT 2")]
+      if len(names) < 2:
+         break
+      with c:
+         for table in ("rows", "cover", "used"):
+            c.execute("DELETE FROM " + table + " WHERE chan = ?",
+                      (names[0],))
+
+def ceil_time(t):
+   """
+   Return the smallest integer time not less than t, exactly even for
+   the large integers of mya times.
+   """
+   n = int(t)
+   if n < t:
+      n += 1
+   return n
+
+def settled(tend):
+   return min(tend, int((time.time() - settle_time) * (1 << 28)))
+
+def add_cover(cover, start, end):
+   """
+   Merge [start, end) into the sorted list of disjoint intervals cover.
+   """
+   if end <= start:
+      return cover
+   merged = []
+   for c in cover:
+      if c[1] < start or c[0] > end:
+         merged.append(c)
+      else:
+         start = min(start, c[0])
+         end = max(end, c[1])
+   merged.append([start, end])
+   merged.sort()
+   return merged
+
+def gaps(cover, start, end):
+   """
+   Return the sub-intervals of [start, end) not contained in cover.
+   """
+   missing = []
+   for c in cover:
+      if c[1] <= start:
+         continue
+      if c[0] >= end:
+         break
+      if c[0] > start:
+         missing.append([start, c[0]])
+      start = max(start, c[1])
+   if start < end:
+      missing.append([start, end])
+   return missing
+
+def store(name, times, vals, start, end):
+   """
+   Add the rows (times, vals) fetched from the archive to the replica,
+   and mark [start, end) as completely covered by them.
+   """
+   with lock:
+      c = connect()
+      with c:
+         if len(times) > 0:
+            rows = zip([name] * len(times),
+                       numpy.asarray(times, dtype=numpy.int64).tolist(),
+                       numpy.asarray(vals, dtype=float).tolist())
+            c.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)",
+                          rows)
+         cover = add_cover(load_cover(name), start, settled(end))
+         c.execute("DELETE FROM cover WHERE chan = ?", (name,))
+         c.executemany("INSERT INTO cover VALUES (?, ?, ?)",
+                       [(name, int(c0), int(c1)) for c0, c1 in cover])
+         c.execute("INSERT OR REPLACE INTO used VALUES (?, ?)",
+                   (name, time.time()))
+      evict()
+
+def fetch(name, start, end, fetcher):
+   """
+   Return the time and val arrays of the rows of channel name with
+   start <= time < end, calling fetcher(t0, t1) only for the parts of
+   the range that are not in the replica yet. fetcher returns the
+   time and val arrays of the rows it found and the time up to which
+   they are complete, which may be less than t1 if the archive query
+   was truncated.
+   """
+   with lock:
+      missing = gaps(load_cover(name), start, end)
+   for t0, t1 in missing:
+      times, vals, tdone = fetcher(t0, t1)
+      store(name, times, vals, t0, tdone)
+   with lock:
+      touch_channel(name)
+      rows = connect().execute("SELECT time, val FROM rows WHERE chan = ?" +
+                               " AND time >= ? AND time < ? ORDER BY time",
+                               (name, ceil_time(start),
+                                ceil_time(end))).fetchall()
+   times = numpy.array([r[0] for r in rows], dtype=numpy.int64)
+   vals = numpy.array([r[1] for r in rows], dtype=float)
+   return times, vals
+
+def lookup(name, t):
+   """
+   Return the last (time, val) row of channel name before t if the
+   replica is known to hold it, otherwise None.
+   """
+   with lock:
+      for c in load_cover(name):
+         if c[0] < t <= c[1]:
+            row = connect().execute("SELECT time, val FROM rows" +
+                                    " WHERE chan = ? AND time >= ?" +
+                                    " AND time < ? ORDER BY time DESC" +
+                                    " LIMIT 1",
+                                    (name, c[0], ceil_time(t))).fetchone()
+            if row is not None:
+               return (row[0], row[1])
+            break
+   return None
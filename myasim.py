@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# myasim.py - simulate the mya archive tables of the active collimator
+#             channels in a local sqlite database, appending new rows
+#             in real time, for testing live.py without the archive.
+#
+# author: richard.t.jones at uconn.edu
+# version: october 18, 2026
+#
+# usage:
+#          $ myasim.py [-d <dbfile>] [-r <rate>] [-H <seconds>] [-n <steps>]
+#
+# and in another session
+#    >>> import live
+#    >>> live.use_local_archive("myasim.db")
+#    >>> live.monitor()
+#
+# notes:
+# 1) The database has the same layout as the archive, a channels table
+#    (chan_id, name, host) and one table_<chan_id> (time, val1) per
+#    channel in live.epicsvars, with times in seconds * (1 << 28).
+# 2) The beam runs at 150 nA for trip_period seconds, then trips off
+#    for trip_length seconds, while the beam spot drifts slowly around
+#    the collimator axis. The wedge currents are the gain 1e9 pedestals
+#    of live.py plus a beam signal that is larger on the side of each
+#    pair of wedges toward which the spot is displaced.
+
+import argparse
+import sqlite3
+import random
+import math
+import time
+
+import live
+
+trip_period = 120 # seconds
+trip_length = 30 # seconds
+beam_current = 150 # nA
+wedge_gain = 20 # adc counts per nA
+gain_index = live.gains.index(1e9)
+
+def create(dbfile):
+   db = sqlite3.connect(dbfile)
+   db.execute("CREATE TABLE IF NOT EXISTS channels " +
+              "(chan_id INTEGER PRIMARY KEY, name TEXT, host TEXT)")
+   tables = {}
+   for var in sorted(live.epicsvars):
+      name = live.epicsvars[var]
+      row = db.execute("SELECT chan_id FROM channels WHERE name = ?",
+                       (name,)).fetchone()
+      if row is None:
+         cur = db.execute("INSERT INTO channels (name, host) VALUES (?, ?)",
+                          (name, "opsmya{0}".format(len(tables) % 9)))
+         chan_id = cur.lastrowid
+      else:
+         chan_id = row[0]
+      db.execute("CREATE TABLE IF NOT EXISTS table_{0} ".format(chan_id) +
+                 "(time INTEGER, val1 REAL)")
+      db.execute("CREATE INDEX IF NOT EXISTS time_{0} ".format(chan_id) +
+                 "ON table_{0} (time)".format(chan_id))
+      tables[var] = "table_{0}".format(chan_id)
+   db.commit()
+   return db, tables
+
+def sample(t):
+   """
+   Return the values of all of the channels at epoch time t.
+   """
+   phase = t % (trip_period + trip_length)
+   cur = beam_current if phase < trip_period else 0
+   cur *= random.gauss(1, 0.005)
+   xspot = 0.5 * math.sin(2 * math.pi * t / 600.)
+   yspot = 0.5 * math.cos(2 * math.pi * t / 900.)
+   vals = {"gain": gain_index,
+           "cur": cur,
+           "xmo": 0.0,
+           "ymo": 0.0,
+           "xbp": xspot,
+           "ybp": yspot,
+           "bpu": cur / beam_current,
+          }
+   peds = live.pedestals[1e9]
+   for ring, scale in (("i", 1.0), ("o", 0.3)):
+      for axis, spot in (("x", xspot), ("y", yspot)):
+         for side, sign in (("p", 1), ("m", -1)):
+            var = ring + axis + side
+            signal = cur * wedge_gain * scale * (1 + 0.4 * sign * spot)
+            vals[var] = peds[var] + signal + random.gauss(0, 2)
+   return vals
+
+def append(db, tables, t):
+   vals = sample(t)
+   for var in tables:
+      db.execute("INSERT INTO {0} VALUES (?, ?)".format(tables[var]),
+                 (int(t * (1 << 28)), vals[var]))
+
+def main():
+   parser = argparse.ArgumentParser(description="simulate the archive " +
+                                    "of the active collimator channels " +
+                                    "in a local sqlite database")
+   parser.add_argument("-d", "--dbfile", default="myasim.db",
+                       help="sqlite database to write")
+   parser.add_argument("-r", "--rate", type=float, default=1,
+                       help="rows per second appended to each channel")
+   parser.add_argument("-H", "--history", type=float, default=0,
+                       help="seconds of past rows to fill in at start")
+   parser.add_argument("-n", "--steps", type=int, default=0,
+                       help="number of rows to append, 0 to run forever")
+   args = parser.parse_args()
+
+   db, tables = create(args.dbfile)
+   now = time.time()
+   t = now - args.history
+   while t < now:
+      append(db, tables, t)
+      t += 1 / args.rate
+   db.commit()
+   step = 0
+   try:
+      while args.steps == 0 or step < args.steps:
+         append(db, tables, time.time())
+         db.commit()
+         step += 1
+         time.sleep(1 / args.rate)
+   except KeyboardInterrupt:
+      pass
+   db.close()
+
+if __name__ == "__main__":
+   main()
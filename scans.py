@@ -9,6 +9,9 @@
 from ROOT import *
 import numpy
 import math
+import accal
+import acpos
+import os
 
 # collimator scans taken 2/16/2018, 8/8/2020
 gains = { 82: 1e9,
@@ -172,6 +175,97 @@ epicsvars = {"ixp": "IOCHDCOL_VMICADC1_1",
 
 lastscan = 0
 
+# Each scan tree is opened once, the columns that the maps need are read
+# into numpy arrays once, and the maps made from them are kept by var,
+# scan and binning, all of it dropped when the root file is modified.
+# map2d hands out clones of the kept maps.
+
+scan_cache = {}
+
+def scan_data(scan):
+   """
+   Return the cache entry of the root file of scan, with the open file
+   and tree, its columns read so far and the maps made so far.
+   """
+   fname = rootfile[scan]
+   mtime = os.path.getmtime(fname)
+   cache = scan_cache.get(fname)
+   if cache is None or cache["mtime"] != mtime:
+      if cache is not None:
+         cache["file"].Close()
+      treefile = TFile(fname)
+      cache = {"mtime": mtime,
+               "file": treefile,
+               "tree": treefile.Get("theTree"),
+               "columns": {},
+               "maps": {},
+              }
+      scan_cache[fname] = cache
+   return cache
+
+def scan_column(cache, expr):
+   """
+   Return the values of tree expression expr for all of the entries
+   of the scan tree in cache as a numpy array.
+   """
+   if not expr in cache["columns"]:
+      tree = cache["tree"]
+      tree.SetEstimate(tree.GetEntries() + 1)
+      n = tree.Draw(expr, "", "goff")
+      if n < 0:
+         raise ValueError("scan_column - bad expression " + expr)
+      v1 = tree.GetV1()
+      v1.SetSize(n)
+      cache["columns"][expr] = numpy.frombuffer(v1, dtype=float,
+                                                count=n).copy()
+   return cache["columns"][expr]
+
+def build_map(var, scan, cache):
+   """
+   Make the map of var over the x,y motor positions of scan from the
+   cached columns, with the same bin contents and errors that
+   tree.Draw(y:x, var*beamcur/cur) gives, and return it.
+   """
+   x = scan_column(cache, epicsvars['xmo'])
+   y = scan_column(cache, epicsvars['ymo'])
+   cur = scan_column(cache, epicsvars['cur'])
+   if cache["tree"].GetBranch(var + "_per_nA"):
+      # precomputed by mda2root.py -d scans_derived.txt
+      w = scan_column(cache, var + "_per_nA") * beamcur[scan]
+   else:
+      v = scan_column(cache, epicsvars[var])
+      with numpy.errstate(divide='ignore', invalid='ignore'):
+         w = v * beamcur[scan] / cur
+   # points without beam current, or with a weight or motor readback
+   # that is not a finite number, are left out of the map
+   good = (cur != 0) & numpy.isfinite(w) & numpy.isfinite(x) & \
+          numpy.isfinite(y)
+   x = x[good]
+   y = y[good]
+   w = w[good]
+   nx, x0, x1 = xsteps[scan]
+   ny, y0, y1 = ysteps[scan]
+   h = TH2D("h2d_{0}_{1}".format(var, scan),
+            "{0} scan {1}".format(var, scan), nx, x0, x1, ny, y0, y1)
+   h.SetDirectory(0)
+   h.Sumw2()
+   # bin numbers as in TAxis::FindBin, 0 and n+1 for under/overflow
+   ix = numpy.clip(numpy.floor(nx * (x - x0) / (x1 - x0)) + 1, 0, nx + 1)
+   iy = numpy.clip(numpy.floor(ny * (y - y0) / (y1 - y0)) + 1, 0, ny + 1)
+   cells = (ix + (nx + 2) * iy).astype(int)
+   ncells = (nx + 2) * (ny + 2)
+   sumw = numpy.bincount(cells, weights=w, minlength=ncells)
+   sumw2 = numpy.bincount(cells, weights=w**2, minlength=ncells)
+   h.SetContent(sumw)
+   h.SetError(numpy.sqrt(sumw2))
+   h.ResetStats()
+   h.SetEntries(numpy.count_nonzero(w))
+   h.GetXaxis().SetTitle("x motor (mm)")
+   h.GetYaxis().SetTitle("y motor (mm)")
+   h.GetYaxis().SetTitleOffset(1.4)
+   h.SetContour(100)
+   return h
+
 def map2d(var, scan):
    """
    special value scan=116.5 returns the average value for scans 116 and 117
@@ -203,8 +297,12 @@ def map2d(var, scan):
    global treefile
    global lastscan
    lastscan = scan
-   treefile = TFile(rootfile[scan])
-   tree = treefile.Get("theTree")
+   cache = scan_data(scan)
+   treefile = cache["file"]
+   tree = cache["tree"]
+   key = (var, scan, tuple(xsteps[scan]), tuple(ysteps[scan]), beamcur[scan])
+   if not key in cache["maps"]:
+      cache["maps"][key] = build_map(var, scan, cache)
    h = gROOT.FindObject("h2d")
    if h:
       h.Delete()
@@ -212,18 +310,7 @@ def map2d(var, scan):
    if not c1:
       c1 = TCanvas("c1", "c1", 50, 50, 540, 500)
       gPad.SetRightMargin(0.15)
-   h = TH2D("h2d", "{0} scan {1}".format(var, scan),
-            xsteps[scan][0], xsteps[scan][1], xsteps[scan][2],
-            ysteps[scan][0], ysteps[scan][1], ysteps[scan][2])
-   xystring = "{1}:{0}".format(epicsvars['xmo'], epicsvars['ymo'])
-   varstring = "({0})*({1})/({2})".format(epicsvars[var], 
-                                          beamcur[scan],
-                                          epicsvars["cur"])
-   tree.Draw(xystring + ">>h2d", varstring)
-   h.GetXaxis().SetTitle("x motor (mm)")
-   h.GetYaxis().SetTitle("y motor (mm)")
-   h.GetYaxis().SetTitleOffset(1.4)
-   h.SetContour(100)
+   h = cache["maps"][key].Clone("h2d")
    h.SetDirectory(0)
    h.SetStats(0)
    suppress_dead(h, scan)
@@ -459,6 +546,10 @@ def check_ix(scan, row1=0, row2=0):
    print "zero crossing is", -res.Parameter(0) / res.Parameter(1)
    return hix
 
+def bin_contents(h, nbins):
+   return numpy.array([h.GetBinContent(i) for i in range(1, nbins + 1)],
+                      dtype=float)
+
 def check2_ix(scan, row1=0, row2=0):
    if scan == 0 and lastscan > 0:
       scan = lastscan
@@ -468,20 +559,13 @@ def check2_ix(scan, row1=0, row2=0):
    hmx = prox(hm, row1, row2, scan)
    hix = hpx.Clone("hix")
    hix.SetTitle("inner x calibration check, scan {0}".format(scan))
-   for i in range(1, xsteps[scan][0] + 1):
-      Ip = hpx.GetBinContent(i)
-      if Ip == 0:
-         continue
-      Ip -= pedestals[scan]['ixp']
-      Im = hmx.GetBinContent(i)
-      Im -= pedestals[scan]['ixm']
-      A = Ip * calparamE[scan]['ixm'] - Im * calparamE[scan]['ixp']
-      B = Ip * calparamF[scan]['ixm'] - Im * calparamF[scan]['ixp']
-      C = Ip * calparamG[scan]['ixm'] - Im * calparamG[scan]['ixp']
-      D = B**2 - 4 * A * C
-      xin = (-B - D**0.5) / (2 * A) 
-      hix.SetBinContent(i, xin)
-      hix.SetBinError(i, 0.05)
+   Ip = bin_contents(hpx, xsteps[scan][0])
+   Im = bin_contents(hmx, xsteps[scan][0])
+   cal = acpos.calibration(scan, calparamE, calparamF, calparamG, pedestals)
+   xin, valid = acpos.reconstruct(Ip, Im, cal, 'ix')
+   for i in numpy.where(Ip != 0)[0]:
+      hix.SetBinContent(i + 1, xin[i] if valid[i] else numpy.nan)
+      hix.SetBinError(i + 1, 0.05)
    res = hix.Fit("pol1","s")
    x = numpy.array([xref[scan], xref[scan]], dtype=float)
    y = numpy.array([-5, 5], dtype=float)
@@ -534,20 +618,13 @@ def check2_iy(scan, row1=0, row2=0):
    hmy = proy(hm, row1, row2, scan)
    hiy = hpy.Clone("hiy")
    hiy.SetTitle("inner y calibration check, scan {0}".format(scan))
-   for i in range(1, ysteps[scan][0] + 1):
-      Ip = hpy.GetBinContent(i)
-      if Ip == 0:
-         continue
-      Ip -= pedestals[scan]['iyp']
-      Im = hmy.GetBinContent(i)
-      Im -= pedestals[scan]['iym']
-      A = Ip * calparamE[scan]['iym'] - Im * calparamE[scan]['iyp']
-      B = Ip * calparamF[scan]['iym'] - Im * calparamF[scan]['iyp']
-      C = Ip * calparamG[scan]['iym'] - Im * calparamG[scan]['iyp']
-      D = B**2 - 4 * A * C
-      yin = (-B - D**0.5) / (2 * A) 
-      hiy.SetBinContent(i, yin)
-      hiy.SetBinError(i, 0.05)
+   Ip = bin_contents(hpy, ysteps[scan][0])
+   Im = bin_contents(hmy, ysteps[scan][0])
+   cal = acpos.calibration(scan, calparamE, calparamF, calparamG, pedestals)
+   yin, valid = acpos.reconstruct(Ip, Im, cal, 'iy')
+   for i in numpy.where(Ip != 0)[0]:
+      hiy.SetBinContent(i + 1, yin[i] if valid[i] else numpy.nan)
+      hiy.SetBinError(i + 1, 0.05)
    res = hiy.Fit("pol1","s")
    x = numpy.array([yref[scan], yref[scan]], dtype=float)
    y = numpy.array([-5, 5], dtype=float)
@@ -600,20 +677,13 @@ def check2_ox(scan, row1=0, row2=0):
    hmx = prox(hm, row1, row2, scan)
    hox = hpx.Clone("hox")
    hox.SetTitle("inner x calibration check, scan {0}".format(scan))
-   for i in range(1, xsteps[scan][0] + 1):
-      Ip = hpx.GetBinContent(i)
-      if Ip == 0:
-         continue
-      Ip -= pedestals[scan]['oxp']
-      Im = hmx.GetBinContent(i)
-      Im -= pedestals[scan]['oxm']
-      A = Ip * calparamE[scan]['oxm'] - Im * calparamE[scan]['oxp']
-      B = Ip * calparamF[scan]['oxm'] - Im * calparamF[scan]['oxp']
-      C = Ip * calparamG[scan]['oxm'] - Im * calparamG[scan]['oxp']
-      D = B**2 - 4 * A * C
-      xout = (-B - D**0.5) / (2 * A) 
-      hox.SetBinContent(i, xout)
-      hox.SetBinError(i, 0.05)
+   Ip = bin_contents(hpx, xsteps[scan][0])
+   Im = bin_contents(hmx, xsteps[scan][0])
+   cal = acpos.calibration(scan, calparamE, calparamF, calparamG, pedestals)
+   xout, valid = acpos.reconstruct(Ip, Im, cal, 'ox')
+   for i in numpy.where(Ip != 0)[0]:
+      hox.SetBinContent(i + 1, xout[i] if valid[i] else numpy.nan)
+      hox.SetBinError(i + 1, 0.05)
    res = hox.Fit("pol1","s")
    x = numpy.array([xref[scan], xref[scan]], dtype=float)
    y = numpy.array([-5, 5], dtype=float)
@@ -666,20 +736,13 @@ def check2_oy(scan, row1=0, row2=0):
    hmy = proy(hm, row1, row2, scan)
    hoy = hpy.Clone("hoy")
    hoy.SetTitle("inner y calibration check, scan {0}".format(scan))
-   for i in range(1, ysteps[scan][0] + 1):
-      Ip = hpy.GetBinContent(i)
-      if Ip == 0:
-         continue
-      Ip -= pedestals[scan]['oyp']
-      Im = hmy.GetBinContent(i)
-      Im -= pedestals[scan]['oym']
-      A = Ip * calparamE[scan]['oym'] - Im * calparamE[scan]['oyp']
-      B = Ip * calparamF[scan]['oym'] - Im * calparamF[scan]['oyp']
-      C = Ip * calparamG[scan]['oym'] - Im * calparamG[scan]['oyp']
-      D = B**2 - 4 * A * C
-      yout = (-B - D**0.5) / (2 * A) 
-      hoy.SetBinContent(i, yout)
-      hoy.SetBinError(i, 0.05)
+   Ip = bin_contents(hpy, ysteps[scan][0])
+   Im = bin_contents(hmy, ysteps[scan][0])
+   cal = acpos.calibration(scan, calparamE, calparamF, calparamG, pedestals)
+   yout, valid = acpos.reconstruct(Ip, Im, cal, 'oy')
+   for i in numpy.where(Ip != 0)[0]:
+      hoy.SetBinContent(i + 1, yout[i] if valid[i] else numpy.nan)
+      hoy.SetBinError(i + 1, 0.05)
    res = hoy.Fit("pol1","s")
    x = numpy.array([yref[scan], yref[scan]], dtype=float)
    y = numpy.array([-5, 5], dtype=float)
@@ -769,6 +832,21 @@ def docal():
       print "{0:6.5f}".format(calparamE[scan]['oyp']),
       print "{0:6.5f}".format(calparamE[scan]['oym'])
 
+def store_calibration(scan, start, end=None, calfile=None):
+   """
+   Add the constants of scan to the accal calibration store under its
+   gain, valid from epoch time start up to end (None for ever), and
+   save the store to calfile if given, eg. ~/.live_calibration.json
+   to have live.py use them.
+   """
+   consts = {"ped": pedestals, "P": calparamP, "Q": calparamQ,
+             "R": calparamR, "S": calparamS,
+             "E": calparamE, "F": calparamF, "G": calparamG}
+   accal.add_set(start, end, dict((p, {gains[scan]: consts[p][scan]})
+                                  for p in consts if scan in consts[p]))
+   if calfile:
+      accal.save(calfile)
+
 ##################################################################
 # Below are the functions that I added to do the calibration
 # of the active collimator response with bias voltage applied,
@@ -17,6 +17,7 @@
 #include <TTreeReaderArray.h>
 
 // Headers needed by this particular selector
+#include "ACblock.h"
 
 
 class transit : public TSelector {
@@ -37,6 +38,10 @@ public :
    TTreeReaderValue<Float_t> cur = {fReader, "stream.cur"};
    TTreeReaderValue<Float_t> gva = {fReader, "stream.gva"};
 
+   // Input written in ACtree block mode is read through fBlocks,
+   // with the current sample unpacked into fSample either way.
+   ACblockReader *fBlocks = 0;
+   acsample_t fSample;
 
    transit(TTree * /*tree*/ =0) { }
    virtual ~transit() { }
@@ -55,6 +60,8 @@ public :
    virtual void    Terminate();
 
    void show_transit(Long64_t entry);
+   Bool_t LoadSample(Long64_t sample);
+   void ProcessSample(Long64_t sample);
 
    ClassDef(transit,0);
 
@@ -73,6 +80,10 @@ void transit::Init(TTree *tree)
    // (once per file to be processed).
 
    fReader.SetTree(tree);
+   delete fBlocks;
+   fBlocks = 0;
+   if (tree->GetBranch("block"))
+      fBlocks = new ACblockReader(tree);
 }
 
 Bool_t transit::Notify()